@@ -14,9 +14,10 @@ setup(
         'dashscope>=1.14.0',
         'click>=8.1.0',
         'PyYAML>=6.0',
-        'Pillow>=10.0.0',
+        'Pillow>=10.1.0',
         'colorama>=0.4.6',
         'requests>=2.31.0',
+        'httpx>=0.25.0',
         'uiautomator2>=3.0.0',
     ],
     entry_points={
@@ -0,0 +1,152 @@
+"""调试产物异步写入 - 截图等文件写盘移出关键字的执行路径"""
+import os
+import time
+import uuid
+import queue
+import atexit
+import threading
+from collections import deque
+from typing import Optional
+
+from .config_manager import get_config
+
+
+class ArtifactSink:
+    """调试产物写入器
+
+    - 后台线程 + 有界队列写盘，队列满时直接丢弃，不阻塞调用方
+    - 文件名带会话 ID 和序号，并行运行互不覆盖
+    - 采样策略 ai.debug.sample: always（每次）/ every_n（每 N 次）/ failure（只在失败时）
+    - 本会话写入的文件超过 ai.debug.max_files 时删除最早的，目录不会无限增长
+    - 内存中保留最近 N 份产物，关键字失败时写到 Robot 输出目录
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        self._initialized = True
+
+        config = get_config()
+        self.enabled = config.get('ai.debug.save_images', True)
+        self.directory = config.get('ai.debug.dir', 'results/artifacts')
+        self.sample = config.get('ai.debug.sample', 'failure')
+        self.every_n = max(1, int(config.get('ai.debug.every_n', 10)))
+        self.fsync = config.get('ai.debug.fsync', False)
+        self.max_files = int(config.get('ai.debug.max_files', 200))
+
+        self.session_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{uuid.uuid4().hex[:6]}"
+        self.dropped = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._ring = deque(maxlen=int(config.get('ai.debug.ring_size', 10)))
+        self._queue = queue.Queue(maxsize=int(config.get('ai.debug.queue_size', 32)))
+        self._thread: Optional[threading.Thread] = None
+        self._written = deque()  # 本会话已写入的文件，只由写入线程访问
+
+    def _ensure_writer(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='artifact-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+                self._rotate(item[0])
+            except Exception as e:
+                print(f"[ArtifactSink] Write failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _rotate(self, path: str):
+        """记录已写入的文件，超过 max_files 时删除本会话最早的文件"""
+        if self.max_files <= 0:
+            return
+        self._written.append(path)
+        while len(self._written) > self.max_files:
+            try:
+                os.remove(self._written.popleft())
+            except OSError:
+                pass
+
+    def _sampled(self, seq: int) -> bool:
+        if self.sample == 'failure':
+            return False
+        if self.sample == 'every_n':
+            return seq % self.every_n == 1 or self.every_n == 1
+        return True
+
+    def submit(self, tag: str, data: bytes, ext: str = 'png') -> Optional[str]:
+        """提交一份产物，返回计划写入的文件名（未采样或被丢弃时返回 None）"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        name = f"{self.session_id}_{seq:05d}_{tag}.{ext}"
+        self._ring.append((name, data))
+
+        if not self._sampled(seq):
+            return None
+        self._ensure_writer()
+        path = os.path.join(self.directory, name)
+        try:
+            self._queue.put_nowait((path, data))
+        except queue.Full:
+            self.dropped += 1
+            return None
+        return path
+
+    def flush_recent(self, output_dir: str) -> int:
+        """把最近的产物写到指定目录（关键字失败时调用），返回写入数量"""
+        items = list(self._ring)
+        self._ring.clear()
+        target = os.path.join(output_dir, 'qrun_artifacts')
+        for name, data in items:
+            try:
+                self._write(os.path.join(target, name), data)
+            except OSError as e:
+                print(f"[ArtifactSink] Flush failed: {e}")
+        if items:
+            print(f"[ArtifactSink] {len(items)} recent artifact(s) saved to {target}")
+        return len(items)
+
+    def close(self, timeout: float = 5.0):
+        """等待队列写完"""
+        if self._thread is None:
+            return
+        deadline = time.time() + timeout
+        while not self._queue.empty() and time.time() < deadline:
+            time.sleep(0.05)
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join(max(0.0, deadline - time.time()))
+        self._thread = None
+
+
+def get_artifact_sink() -> ArtifactSink:
+    """获取调试产物写入器实例"""
+    return ArtifactSink()
@@ -0,0 +1,32 @@
+"""界面签名：用于低成本判断屏幕是否发生变化"""
+import hashlib
+
+from PIL import Image
+
+
+def frame_hash(image: Image.Image, hash_size: int = 16) -> int:
+    """差值感知哈希 (dHash)
+
+    缩成 (hash_size+1) x hash_size 的灰度图，比较相邻像素明暗，
+    得到 hash_size*hash_size 位的整数。对编码噪声和轻微缩放不敏感。
+    """
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR,
+                                      reducing_gap=2.0)
+    pixels = small.tobytes()
+    width = hash_size + 1
+    value = 0
+    for y in range(hash_size):
+        row = pixels[y * width:(y + 1) * width]
+        for x in range(hash_size):
+            value = (value << 1) | (row[x] > row[x + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    """两个哈希的汉明距离"""
+    return (a ^ b).bit_count()
+
+
+def hierarchy_digest(xml: str) -> str:
+    """UI 结构摘要，XML 任意变化都会改变摘要"""
+    return hashlib.blake2b(xml.encode('utf-8'), digest_size=16).hexdigest()
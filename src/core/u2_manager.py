@@ -1,11 +1,29 @@
 """uiautomator2 设备管理模块"""
+import re
 import time
 import base64
-from typing import Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
 
 import uiautomator2 as u2
 
 from .config_manager import get_config
+from .frame_signature import frame_hash, hamming, hierarchy_digest
+
+
+_ROOT_BOUNDS_RE = re.compile(r'bounds="\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]"')
+
+
+@dataclass
+class Snapshot:
+    """同一时刻采集的截图、UI 结构和窗口大小"""
+    image: Any  # PIL.Image
+    xml: str
+    width: int
+    height: int
+    timestamp: float  # 采集时间（开始与结束的中点）
+    consistent: bool = True  # 截图与 XML 是否来自同一画面方向/尺寸
 
 
 class U2Manager:
@@ -13,6 +31,7 @@ class U2Manager:
     
     _instance = None
     _device = None
+    _executor = None
     
     def __new__(cls):
         if cls._instance is None:
@@ -81,6 +100,15 @@ class U2Manager:
                 print(f"Screenshot failed: {e}")
         return None
     
+    def get_screenshot_image(self):
+        """获取截图 PIL 图片（不做额外编码）"""
+        if self._device:
+            try:
+                return self._device.screenshot()
+            except Exception as e:
+                print(f"Screenshot failed: {e}")
+        return None
+    
     def save_screenshot(self, filename: str):
         """保存截图到文件"""
         if self._device:
@@ -113,6 +141,168 @@ class U2Manager:
                 pass
         return {'width': 1080, 'height': 1920}
     
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if U2Manager._executor is None:
+            U2Manager._executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='u2-capture')
+        return U2Manager._executor
+    
+    def _snapshot_consistent(self, image, xml: str, size: Dict[str, int], after=None) -> bool:
+        """截图、XML 根节点和窗口大小的方向与尺寸一致，才认为来自同一画面
+        
+        after 为 XML 导出完成后再截的一帧：与 image 的感知哈希相差超过
+        device.snapshot_threshold 说明采集期间界面在滚动/切换，XML 可能对应另一帧。
+        """
+        if after is not None:
+            threshold = self.config.get('device.snapshot_threshold', 2)
+            if hamming(frame_hash(image), frame_hash(after)) > threshold:
+                return False
+        img_w, img_h = image.size
+        if (img_w > img_h) != (size['width'] > size['height']):
+            return False
+        
+        match = _ROOT_BOUNDS_RE.search(xml)
+        if match:
+            root_w, root_h = int(match.group(3)), int(match.group(4))
+            if (root_w > root_h) != (img_w > img_h):
+                return False
+            # 根节点不应超出截图范围（允许少量误差）
+            if root_w > img_w + 2 or root_h > img_h + 2:
+                return False
+        return True
+    
+    def capture_snapshot(self, retries: int = None) -> Optional[Snapshot]:
+        """并发采集截图、UI 结构和窗口大小
+        
+        三个请求互相独立，放到小线程池里并行发出，耗时约等于最慢的一个。
+        采集结果做一致性校验（采集期间发生旋转），不一致时重新采集。
+        开启 device.snapshot_verify 时 XML 导出完成后再截一帧，与开始时的截图比较，
+        能发现采集期间的滚动或页面切换，但每次采集多一次串行截图；操作后已有 wait_idle
+        等待界面稳定，默认不开启。
+        
+        Args:
+            retries: 不一致时的重试次数，默认读取 device.snapshot_retries
+        
+        Returns:
+            Snapshot，设备未连接或采集失败时返回 None
+        """
+        if not self._device:
+            return None
+        if retries is None:
+            retries = self.config.get('device.snapshot_retries', 1)
+        
+        executor = self._get_executor()
+        verify = self.config.get('device.snapshot_verify', False)
+        snapshot = None
+        for attempt in range(retries + 1):
+            start = time.time()
+            image_future = executor.submit(self.get_screenshot_image)
+            xml_future = executor.submit(self.get_page_source)
+            size_future = executor.submit(self.get_window_size)
+            image, xml, size = image_future.result(), xml_future.result(), size_future.result()
+            end = time.time()
+            
+            if image is None or not xml:
+                return None
+            # XML 导出往往最慢，它完成后的一帧与开始时的一帧相同，才说明两者之间界面没动
+            after = self.get_screenshot_image() if verify else None
+            
+            snapshot = Snapshot(
+                image=image,
+                xml=xml,
+                width=size['width'],
+                height=size['height'],
+                timestamp=(start + end) / 2,
+                consistent=self._snapshot_consistent(image, xml, size, after),
+            )
+            if snapshot.consistent:
+                return snapshot
+            print(f"Snapshot inconsistent (attempt {attempt + 1}), recapturing...")
+        
+        return snapshot
+    
+    def _idle_signature(self, mode: str) -> Optional[Tuple[Optional[int], Optional[str]]]:
+        """界面稳定检测用的签名：(感知哈希, UI 结构摘要)，按 mode 只采集需要的部分"""
+        frame = digest = None
+        if mode in ('frame', 'both'):
+            image = self.get_screenshot_image()
+            if image is None:
+                return None
+            frame = frame_hash(image)
+        if mode in ('hierarchy', 'both'):
+            xml = self.get_page_source()
+            if not xml:
+                return None
+            digest = hierarchy_digest(xml)
+        return frame, digest
+    
+    def _idle_changed(self, signature, last, threshold: int) -> bool:
+        if signature is None or last is None:
+            return True
+        if signature[0] is not None and hamming(signature[0], last[0]) > threshold:
+            return True
+        return signature[1] != last[1]
+    
+    def wait_idle(self, quiet: float = None, timeout: float = None, settle: float = None,
+                  on_stable: Optional[Callable[[], None]] = None) -> bool:
+        """等待界面稳定（替代操作后的固定等待）
+        
+        连续采样界面签名（device.idle.signature: frame / hierarchy / both），
+        签名在 quiet 秒内保持不变即认为稳定；超过 timeout 仍在变化（动画、视频、
+        加载指示器）时不再等待，也不抛异常。
+        
+        操作的响应可能晚于静默窗口才开始，因此在看到第一次变化之前，
+        至少等满 settle 秒才认为稳定，避免停在操作前的画面上。
+        
+        Args:
+            quiet: 静默窗口（秒），默认 device.idle.quiet
+            timeout: 最长等待（秒），默认 device.idle.timeout
+            settle: 未观察到变化时的最短等待（秒），默认 device.idle.settle
+            on_stable: 操作效果已出现（或已等满 settle）后界面第一次保持不变时回调，
+                与静默窗口的确认并行（如开始预取下一步）；之后界面再变化会再次回调
+        
+        Returns:
+            bool: 是否在超时前稳定
+        """
+        if not self._device:
+            return False
+        if quiet is None:
+            quiet = self.config.get('device.idle.quiet', 0.3)
+        if timeout is None:
+            timeout = self.config.get('device.idle.timeout', 5.0)
+        if settle is None:
+            settle = self.config.get('device.idle.settle', 0.5)
+        mode = self.config.get('device.idle.signature', 'frame')
+        poll = self.config.get('device.idle.poll', 0.1)
+        threshold = self.config.get('device.idle.threshold', 2)
+        
+        start = time.time()
+        last = self._idle_signature(mode)
+        if last is None:
+            # 采样失败时退回固定等待
+            time.sleep(max(quiet, settle))
+            return False
+        stable_since = time.time()
+        changed = steady = notified = False
+        while True:
+            now = time.time()
+            settled = changed or now - start >= settle
+            if settled and not notified and on_stable is not None \
+                    and (steady or now - stable_since >= quiet):
+                notified = True
+                on_stable()
+            if settled and now - stable_since >= quiet:
+                return True
+            if now - start >= timeout:
+                print(f"UI not idle after {timeout:.1f}s, continuing")
+                return False
+            time.sleep(poll)
+            signature = self._idle_signature(mode)
+            if self._idle_changed(signature, last, threshold):
+                last, stable_since = signature, time.time()
+                changed, steady, notified = True, False, False
+            else:
+                steady = True
+    
     def tap(self, x: int, y: int):
         """点击屏幕坐标"""
         if self._device:
@@ -174,7 +364,9 @@ class U2Manager:
         
         if package and self._device:
             self._device.app_start(package)
-            time.sleep(2)
+            # 启动页常有短暂静止，静默窗口取长一些
+            self.wait_idle(self.config.get('device.idle.launch_quiet', 1.0),
+                           self.config.get('device.idle.launch_timeout', 10.0))
     
     def stop_app(self, package: str = None):
         """停止应用"""
@@ -205,6 +397,18 @@ class U2Manager:
                 pass
         return {'package': '', 'activity': ''}
     
+    def get_app_version(self, package: str = None) -> str:
+        """获取应用版本号（versionName，取不到返回空字符串）"""
+        if not package:
+            package = self.config.get('app.package')
+        
+        if package and self._device:
+            try:
+                return str(self._device.app_info(package).get('versionName') or '')
+            except:
+                pass
+        return ''
+    
     def wait_activity(self, activity: str, timeout: float = 10) -> bool:
         """等待指定 Activity"""
         if self._device:
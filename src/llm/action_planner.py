@@ -1,11 +1,72 @@
 """AI 动作规划器 - 自动拆解自然语言指令"""
 import json
 import time
-from typing import List, Dict
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set
 
 from .qianwen_client import QianwenClient
 from .visual_locator import VisualLocator
+from .plan_store import get_plan_store
+from .json_extract import ArrayStream
+from .response_schema import validate_plan
+from .resilience import CircuitOpenError
 from ..core.u2_manager import get_u2
+from ..core.config_manager import get_config
+
+
+class PlanFeed:
+    """逐步到达的规划步骤
+
+    流式规划时边拉取模型输出边解析，已完整到达的步骤可以先执行；
+    已保存或一次性得到的规划直接包装成已结束的 feed。
+    """
+
+    def __init__(self, chunks: Optional[Iterator[str]] = None, steps: Optional[List[Dict]] = None):
+        self.steps: List[Dict] = list(steps or [])
+        self.done = chunks is None
+        self._chunks = chunks
+        self._parser = ArrayStream()
+
+    def fill(self, count: int) -> bool:
+        """拉取输出直到至少有 count 个步骤或输出结束
+
+        Returns:
+            是否已有 count 个步骤
+
+        Raises:
+            ValueError: 步骤无法解析或不符合规划结构（SchemaError）
+        """
+        while len(self.steps) < count and not self.done:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self.done = True
+                break
+            for step in self._parser.feed(chunk):
+                self.steps.extend(validate_plan([step]))
+            if self._parser.closed:
+                # 数组结束后流里只剩结束事件，由后台读完（见 stream_text 的 drain）
+                self.done = True
+                self._chunks.close()
+        return len(self.steps) >= count
+
+
+class Prefetch:
+    """后台预取的下一步定位：先采集快照（记录界面签名），再调用模型定位"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.signature = None
+        self.captured = threading.Event()
+        self.cancelled = False
+        self.future: Optional[Future] = None
+
+    def cancel(self):
+        """丢弃预取：未开始的直接取消，已开始的在调用模型前退出"""
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
 
 
 class ActionPlanner:
@@ -15,18 +76,16 @@ class ActionPlanner:
         self.qianwen = QianwenClient()
         self.locator = VisualLocator()
         self.u2 = get_u2()
+        self.plans = get_plan_store()
+        config = get_config()
+        self.stream = config.get('ai.planner.stream', True)
+        self.prefetch = config.get('ai.planner.prefetch', True)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._prefetch_locator: Optional[VisualLocator] = None
     
-    def plan_actions(self, instruction: str) -> List[Dict]:
-        """
-        将自然语言指令拆解为操作步骤
-        
-        Args:
-            instruction: 自然语言指令，如 "打开应用，输入用户名 test，点击登录"
-        
-        Returns:
-            list: 操作步骤列表
-        """
-        prompt = f"""你是一个 Android 自动化测试专家。将以下自然语言指令拆解为具体的操作步骤。
+    @staticmethod
+    def _plan_prompt(instruction: str) -> str:
+        return f"""你是一个 Android 自动化测试专家。将以下自然语言指令拆解为具体的操作步骤。
 
 指令: {instruction}
 
@@ -53,16 +112,32 @@ class ActionPlanner:
 - swipe: 滑动（需要 direction: up/down/left/right）
 - back: 按返回键
 - home: 按主页键"""
+    
+    def plan_actions(self, instruction: str, use_cache: bool = True) -> List[Dict]:
+        """
+        将自然语言指令拆解为操作步骤
         
-        response = self.qianwen.generate(prompt)
-        return self.qianwen.parse_json_response(response)
+        Args:
+            instruction: 自然语言指令，如 "打开应用，输入用户名 test，点击登录"
+            use_cache: False 时不读响应缓存（上次的规划执行失败，需要重新生成）
+        
+        Returns:
+            list: 操作步骤列表
+        """
+        prompt = self._plan_prompt(instruction)
+        # 快速模型拆出的步骤不合法时升级到更强的模型
+        return self.qianwen.ask(prompt, lambda r: self.qianwen.parse_json_response(r, schema='plan'),
+                                site='plan', text=True, use_cache=use_cache)
     
-    def execute_action(self, action: Dict) -> bool:
+    def execute_action(self, action: Dict, element=None) -> bool:
         """
         执行单个操作
         
+        操作后的界面稳定等待由 execute 统一处理（与下一步的预取并行）。
+        
         Args:
             action: 操作字典
+            element: 预先批量定位好的元素（click/input 可用）
         
         Returns:
             bool: 是否成功
@@ -71,7 +146,6 @@ class ActionPlanner:
         
         if action_type == 'open_app':
             self.u2.launch_app()
-            time.sleep(2)
             return True
         
         elif action_type == 'close_app':
@@ -82,14 +156,14 @@ class ActionPlanner:
             target = action.get('target')
             if not target:
                 raise ValueError("click 操作需要 target")
-            return self.locator.click_element(target)
+            return self.locator.click_element(target, element)
         
         elif action_type == 'input':
             target = action.get('target')
             text = action.get('text', '')
             if not target:
                 raise ValueError("input 操作需要 target")
-            return self.locator.input_text(text, target)
+            return self.locator.input_text(text, target, element)
         
         elif action_type == 'wait':
             condition = action.get('condition')
@@ -121,23 +195,140 @@ class ActionPlanner:
                 self.u2.swipe(center_x + 300, center_y, center_x - 300, center_y)
             elif direction == 'right':
                 self.u2.swipe(center_x - 300, center_y, center_x + 300, center_y)
-            
-            time.sleep(0.5)
             return True
         
         elif action_type == 'back':
             self.u2.press_back()
-            time.sleep(0.5)
             return True
         
         elif action_type == 'home':
             self.u2.press_home()
-            time.sleep(0.5)
             return True
         
         else:
             raise ValueError(f"未知的操作类型: {action_type}")
     
+    def _locate_batch(self, steps: List[Dict], start: int, snapshot=None,
+                      locator: Optional[VisualLocator] = None) -> Dict[int, object]:
+        """表单类步骤批量定位
+        
+        从 start 开始连续的 input 步骤（加上紧随其后的一个 click，如提交按钮）
+        作用在同一屏幕上，一次模型调用定位所有目标。
+        
+        Args:
+            snapshot: 已采集的快照（预取时使用），不传则重新采集
+            locator: 使用的定位器，默认 self.locator（预取线程用自己的定位器）
+        
+        Returns:
+            dict: {步骤下标: 元素}
+        """
+        batch = []
+        i = start
+        while i < len(steps) and steps[i].get('action') == 'input' and steps[i].get('target'):
+            batch.append(i)
+            i += 1
+        if batch and i < len(steps) and steps[i].get('action') == 'click' and steps[i].get('target'):
+            batch.append(i)
+        
+        if len(batch) < 2:
+            return {}
+        
+        try:
+            found = (locator or self.locator).find_elements([steps[j]['target'] for j in batch], snapshot)
+        except Exception as e:
+            print(f"  批量定位失败，逐个定位: {e}")
+            return {}
+        return {j: found[steps[j]['target']] for j in batch if steps[j]['target'] in found}
+    
+    def _start_prefetch(self, feed: PlanFeed, index: int) -> Optional[Prefetch]:
+        """界面一停止变化就在后台采集快照并定位第 index 步，与静默窗口的确认并行
+        
+        只预取已经完整到达的 click/input 步骤（连续 input 要整组到达才能批量定位）。
+        定位器的标记渲染、排序候选等状态不是线程安全的，预取使用独立的定位器，
+        并且单线程依次执行。
+        """
+        steps = feed.steps
+        if index >= len(steps) or steps[index].get('action') not in ('click', 'input') \
+                or not steps[index].get('target'):
+            return None
+        end = index
+        while end < len(steps) and steps[end].get('action') == 'input':
+            end += 1
+        if end >= len(steps) and not feed.done:
+            return None
+        
+        prefetch = Prefetch(index)
+        snapshot_steps = list(steps)
+        
+        if self._prefetch_locator is None:
+            self._prefetch_locator = VisualLocator()
+        locator = self._prefetch_locator
+        
+        def run() -> Dict[int, object]:
+            try:
+                if prefetch.cancelled:
+                    return {}
+                snapshot = self.u2.capture_snapshot()
+                if snapshot is None:
+                    return {}
+                prefetch.signature = locator.snapshot_signature(snapshot)
+            finally:
+                prefetch.captured.set()
+            if prefetch.cancelled:
+                return {}
+            located = self._locate_batch(snapshot_steps, index, snapshot, locator)
+            if index not in located and not prefetch.cancelled:
+                located[index] = locator.find_element(snapshot_steps[index]['target'], snapshot)
+            return located
+        
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='plan-prefetch')
+        prefetch.future = self._executor.submit(run)
+        return prefetch
+    
+    def _take_prefetch(self, prefetch: Prefetch) -> Dict[int, object]:
+        """派发时检查预取：界面签名没变才使用定位结果，否则丢弃重新定位"""
+        if not prefetch.captured.is_set() and prefetch.future.cancel():
+            # 还排在上一个（已丢弃的）预取后面，直接定位更快
+            return {}
+        prefetch.captured.wait()
+        if prefetch.signature is None or not self.locator.screen_matches(prefetch.signature):
+            prefetch.cancel()
+            print("  界面已变化，丢弃预取的定位结果")
+            return {}
+        try:
+            located = prefetch.future.result()
+        except Exception as e:
+            print(f"  预取定位失败，重新定位: {e}")
+            return {}
+        # 预取定位器记录的排序候选交给主定位器，点击时同样可以本地换候选
+        self.locator.adopt_rankings(self._prefetch_locator, located.values())
+        print("  使用预取的定位结果")
+        return located
+    
+    def _stream_plan(self, instruction: str, use_cache: bool = True) -> PlanFeed:
+        """流式规划，第一个步骤到达即返回
+        
+        第一个步骤之前出错（接口失败、解析失败、结构不合法）时退回 plan_actions，
+        由它按档位升级重新规划；之后出错时已有步骤执行过，只能让本次执行失败。
+        """
+        tier = self.qianwen.router.tiers('plan')[0]
+        started = time.time()
+        accept = lambda r: self.qianwen.parse_json_response(r, schema='plan')
+        feed = PlanFeed(self.qianwen.stream_text(self._plan_prompt(instruction), site='plan', tier=tier,
+                                                 accept=accept, use_cache=use_cache, drain=True))
+        try:
+            ready = feed.fill(1)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            print(f"  流式规划失败，重新规划: {e}")
+            ready = False
+        self.qianwen.router.record('plan', tier, ready, time.time() - started)
+        if ready:
+            return feed
+        return PlanFeed(steps=self.plan_actions(instruction, use_cache))
+    
     def execute(self, instruction: str) -> bool:
         """
         规划并执行自然语言指令
@@ -148,23 +339,80 @@ class ActionPlanner:
         Returns:
             bool: 是否全部成功
         """
-        # 规划步骤
-        steps = self.plan_actions(instruction)
+        # 规划步骤：同一应用版本上执行过的指令直接复用已校验的步骤
+        package = self.u2.config.get('app.package', '')
+        version = self.u2.get_app_version(package)
+        steps = self.plans.get(instruction, package, version)
+        # 上次的规划执行失败时，响应缓存里还是同一份规划，重新规划要绕过缓存
+        use_cache = steps is None and not self.plans.invalidated(instruction, package, version)
+        if steps is not None:
+            print(f"使用已保存的规划（{len(steps)} 步）")
+            feed = PlanFeed(steps=steps)
+        elif self.stream:
+            # 边生成边执行：每个步骤完整到达就开始执行，后面的步骤继续生成
+            feed = self._stream_plan(instruction, use_cache)
+        else:
+            feed = PlanFeed(steps=self.plan_actions(instruction, use_cache))
+        stored = steps is not None
+        located: Dict[int, object] = {}
+        stale: Set[int] = set()  # 定位之后又执行过操作的步骤
+        prefetch: Optional[Prefetch] = None
         
         # 依次执行
-        for i, step in enumerate(steps):
-            action_type = step.get('action')
-            target = step.get('target', step.get('condition', ''))
-            
-            print(f"Step {i+1}: {action_type} {target}")
-            
-            try:
-                self.execute_action(step)
+        i = 0
+        try:
+            while feed.fill(i + 1):
+                step = feed.steps[i]
+                action_type = step.get('action')
+                target = step.get('target', step.get('condition', ''))
+                
+                print(f"Step {i+1}: {action_type} {target}")
+                
+                if prefetch is not None and prefetch.index == i:
+                    located.update(self._take_prefetch(prefetch))
+                prefetch = None
+                if i not in located:
+                    # 连续的 input 步骤要等整组到达才能批量定位
+                    j = i
+                    while feed.fill(j + 1) and feed.steps[j].get('action') == 'input':
+                        j += 1
+                    located.update(self._locate_batch(feed.steps, i))
+                
+                # 规划完整后立即保存，执行失败时才能被标记为失效
+                if feed.done and not stored:
+                    self.plans.put(instruction, package, version, feed.steps)
+                    stored = True
+                
+                element = located.pop(i, None)
+                if element is not None and i in stale:
+                    # 批量定位时的界面已被前面的步骤改变（获得焦点、键盘弹出、粘贴），先核对
+                    element = self.locator.refresh_element(element)
+                    if element is None:
+                        print("  批量定位的元素已不在原处，重新定位")
+                self.execute_action(step, element)
+                stale.update(located)
                 print(f"  ✓ 成功")
-            except Exception as e:
-                print(f"  ✗ 失败: {e}")
-                raise
-            
-            time.sleep(0.5)
+                
+                # 等待界面稳定；操作效果出现后界面一停止变化就在后台预取下一步的定位，
+                # 之后界面又变化时重新预取（派发时还会再核对界面签名）
+                def restart_prefetch():
+                    nonlocal prefetch
+                    if prefetch is not None:
+                        prefetch.cancel()
+                    prefetch = self._start_prefetch(feed, i + 1)
+                
+                prefetch_next = self.prefetch and i + 1 not in located
+                self.u2.wait_idle(on_stable=restart_prefetch if prefetch_next else None)
+                i += 1
+        except Exception as e:
+            print(f"  ✗ 失败: {e}")
+            if prefetch is not None:
+                prefetch.cancel()
+            # 失败的规划不再复用，下次重新规划
+            self.plans.record(instruction, package, version, success=False)
+            raise
         
+        if not stored:
+            self.plans.put(instruction, package, version, feed.steps)
+        self.plans.record(instruction, package, version, success=True)
         return True
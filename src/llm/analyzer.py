@@ -136,7 +136,7 @@ class ResultAnalyzer:
 
 输出格式清晰，便于理解。"""
         
-        analysis = self.qianwen.generate(prompt)
+        analysis = self.qianwen.generate(prompt, site='analyze')
         
         # 组合报告
         report = f"""测试统计:
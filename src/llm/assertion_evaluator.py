@@ -0,0 +1,148 @@
+"""AI Assert 本地判定 - 能用 UI 结构回答的断言不再发截图"""
+from typing import Dict, List, Optional
+
+from .element_index import normalize_text
+from .element_table import ElementTable
+
+
+TRANSLATE_PROMPT = """你是 Android UI 测试助手。把下面的界面断言翻译成对界面文本的检查。
+
+断言: {assertion}
+
+只返回 JSON（不要其他内容）：
+{{"decidable": true, "logic": "all", "checks": [{{"text": "登录成功", "match": "contains", "min": 1, "max": null}}]}}
+
+规则：
+- 每个 check 统计界面上可见文本（text / content-desc）中匹配 text 的节点数，要求 min <= 数量 <= max（max 为 null 表示不限）
+- match: exact（完全相同）或 contains（包含）
+- "不显示 X" 写成 {{"text": "X", "min": 0, "max": 0}}
+- logic: all（全部满足）或 any（任一满足）
+- 依赖颜色、图标、图片、布局位置、数值比较等无法只靠文本判断的断言，返回 {{"decidable": false}}
+"""
+
+
+class AssertionEvaluator:
+    """把断言翻译成 UI 结构上的文本谓词并在本地求值
+
+    - 翻译只调用一次纯文本模型，结果按断言字符串缓存
+    - 谓词成立 -> 通过；明确出现了不应出现的文本 -> 失败
+    - 需要的文本在结构里找不到时（可能只画在图片/WebView 里）无法判定，交给多模态模型
+    - 同理，靠"结构里没有某文本"才成立的检查（Toast、WebView 里的文本不在结构中）也不算通过
+    """
+
+    def __init__(self, qianwen):
+        self.qianwen = qianwen
+        self._predicates: Dict[str, Optional[dict]] = {}
+
+    def translate(self, assertion: str) -> Optional[dict]:
+        """断言 -> 谓词（按断言字符串缓存，无法判定缓存为 None）"""
+        if assertion in self._predicates:
+            return self._predicates[assertion]
+
+        try:
+            predicate = self.qianwen.ask(TRANSLATE_PROMPT.format(assertion=assertion), self._accept,
+                                         site='verify', text=True)
+        except Exception as e:
+            # 调用失败不缓存，下次再试
+            print(f"[AssertionEvaluator] Translate failed: {e}")
+            return None
+
+        if not self._valid(predicate):
+            predicate = None
+        self._predicates[assertion] = predicate
+        return predicate
+
+    def _accept(self, response: str) -> dict:
+        """翻译结果至少要是带 decidable 字段的对象，否则交给更强的模型重译"""
+        predicate = self.qianwen.parse_json_response(response)
+        if not isinstance(predicate, dict) or 'decidable' not in predicate:
+            raise ValueError(f"谓词格式错误: {response[:100]}")
+        return predicate
+
+    @staticmethod
+    def _bound(value, default: Optional[int]) -> Optional[int]:
+        """min/max 转成非负整数（null 取默认值），模型给出非数值时抛出 ValueError"""
+        if value is None or value == '':
+            return default
+        if isinstance(value, bool):
+            raise ValueError(f"无效的计数: {value!r}")
+        number = int(value)
+        if number < 0:
+            raise ValueError(f"无效的计数: {value!r}")
+        return number
+
+    @classmethod
+    def _valid(cls, predicate) -> bool:
+        """校验谓词结构，并把每个 check 的 min/max 规整为整数"""
+        if not isinstance(predicate, dict) or not predicate.get('decidable'):
+            return False
+        checks = predicate.get('checks')
+        if not isinstance(checks, list) or not checks:
+            return False
+        for check in checks:
+            if not (isinstance(check, dict) and isinstance(check.get('text'), str) and check['text'].strip()):
+                return False
+            try:
+                check['min'] = cls._bound(check.get('min'), 0)
+                check['max'] = cls._bound(check.get('max'), None)
+            except (TypeError, ValueError):
+                return False
+            if check['max'] is not None and check['max'] < check['min']:
+                return False
+        return True
+
+    @staticmethod
+    def _visible_texts(table: ElementTable, screen_w: int, screen_h: int) -> List[str]:
+        texts = []
+        for row in table.visible_rows(screen_w, screen_h):
+            for value in (table.text[row], table.desc[row]):
+                if value:
+                    texts.append(normalize_text(value))
+        return texts
+
+    @staticmethod
+    def _count(texts: List[str], check: dict) -> int:
+        target = normalize_text(check['text'])
+        if check.get('match') == 'exact':
+            return sum(1 for t in texts if t == target)
+        return sum(1 for t in texts if target in t)
+
+    def evaluate(self, assertion: str, table: ElementTable, screen_w: int, screen_h: int) -> Optional[Dict]:
+        """本地判定断言
+
+        Returns:
+            {'passed': bool, 'reason': str}；无法判定时返回 None
+        """
+        if table.parse_error or not len(table):
+            return None
+        predicate = self.translate(assertion)
+        if predicate is None:
+            return None
+
+        texts = self._visible_texts(table, screen_w, screen_h)
+        logic = predicate.get('logic', 'all')
+        passed, present, reasons, decisive_fail = [], [], [], False
+
+        for check in predicate['checks']:
+            count = self._count(texts, check)
+            low, high = check['min'], check['max']
+            ok = low <= count and (high is None or count <= high)
+            passed.append(ok)
+            # 数量为 0 时成立的检查只说明结构里没有，文本仍可能画在像素里
+            present.append(ok and count > 0)
+            reasons.append(f"\"{check['text']}\" 出现 {count} 次")
+            # 结构里多出来的文本是确定的；缺少的文本可能只是没进 UI 结构
+            if not ok and high is not None and count > high:
+                decisive_fail = True
+
+        reason = "UI 结构检查: " + "，".join(reasons)
+        if logic == 'any':
+            if any(present):
+                return {'passed': True, 'reason': reason}
+            return None
+
+        if all(present):
+            return {'passed': True, 'reason': reason}
+        if decisive_fail:
+            return {'passed': False, 'reason': reason}
+        return None
@@ -0,0 +1,202 @@
+"""元素属性倒排索引 - 描述直接命中界面文本时的本地快速定位"""
+import re
+import unicodedata
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Set, Tuple
+
+
+# 描述里常见的控件类型后缀，归一化时去掉（"登录按钮" -> "登录"）
+ROLE_SUFFIXES = ('按钮', '图标', '选项', '输入框', '文本框', '搜索框', '标签', '入口', '开关',
+                 '菜单', 'button', 'icon', 'tab')
+
+# 带方位/序号的描述依赖视觉上下文，不走本地匹配
+POSITIONAL_RE = re.compile(
+    r'(左侧|左边|左上|左下|右侧|右边|右上|右下|顶部|底部|上方|下方|上面|下面|旁边|中间|角落|'
+    r'第[一二三四五六七八九十\d]+个|最后一个)'
+)
+
+# 去掉后缀后只接受对应类型的控件，否则"用户名输入框"会命中旁边的"用户名"标签
+EDIT_ROLES = ('输入框', '文本框', '搜索框')
+CLICK_ROLES = ('按钮', 'button')
+
+_STRIP_RE = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def normalize_text(value: str) -> str:
+    """归一化文本：全角转半角、小写、去掉空白和标点"""
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFKC', value).lower()
+    return _STRIP_RE.sub('', value)
+
+
+def _split_role_suffix(key: str) -> Tuple[str, str]:
+    """拆出控件类型后缀：("用户名输入框") -> ("用户名", "输入框")，没有后缀时后缀为空"""
+    for suffix in ROLE_SUFFIXES:
+        if key.endswith(suffix) and len(key) > len(suffix):
+            return key[:-len(suffix)], suffix
+    return key, ''
+
+
+def _strip_role_suffix(key: str) -> str:
+    """去掉控件类型后缀，去掉后为空则保留原值"""
+    return _split_role_suffix(key)[0]
+
+
+def _role_matches(elem, role: str) -> bool:
+    """元素是否是后缀所指的控件类型（输入类要求 EditText，按钮要求可点击）"""
+    if role in EDIT_ROLES:
+        return 'EditText' in (elem.class_name or '')
+    if role in CLICK_ROLES:
+        return elem.clickable
+    return True
+
+
+def _resource_name(resource_id: str) -> str:
+    """com.android.settings:id/title -> title"""
+    if ':id/' in resource_id:
+        return resource_id.split(':id/', 1)[1]
+    return resource_id
+
+
+def _bigrams(key: str) -> Set[str]:
+    if len(key) < 2:
+        return {key} if key else set()
+    return {key[i:i + 2] for i in range(len(key) - 1)}
+
+
+@dataclass
+class IndexMatch:
+    """一次索引命中"""
+    element: object  # VisualElement
+    score: float
+    field: str  # text / desc / resource-id / alias
+    kind: str  # exact / normalized / fuzzy
+
+
+class ElementIndex:
+    """单屏元素的倒排索引
+
+    对每个元素的 text、content-desc、resource-id 及合并进来的子节点文本建立三层索引：
+    1. 原值精确匹配 (score 1.0)
+    2. 归一化匹配 (score 0.95)
+    3. 基于字符二元组召回 + 相似度打分的模糊匹配 (score <= 0.9)
+    """
+
+    EXACT_SCORE = 1.0
+    NORMALIZED_SCORE = 0.95
+    FUZZY_WEIGHT = 0.9
+    FUZZY_MIN_LEN = 3
+
+    def __init__(self, elements: List):
+        self.elements = elements
+        self._exact: Dict[str, Set[Tuple[int, str]]] = {}
+        self._normalized: Dict[str, Set[Tuple[int, str]]] = {}
+        self._keys: List[Tuple[str, int, str]] = []  # (归一化值, 元素下标, 字段)
+        self._bigram_index: Dict[str, Set[int]] = {}
+
+        for pos, elem in enumerate(elements):
+            for field, value in self._element_fields(elem):
+                self._add(pos, field, value)
+
+    @staticmethod
+    def _element_fields(elem) -> List[Tuple[str, str]]:
+        fields = [
+            ('text', elem.text),
+            ('desc', elem.desc),
+            ('resource-id', _resource_name(elem.resource_id)),
+        ]
+        fields.extend(('alias', alias) for alias in elem.aliases)
+        return [(field, value.strip()) for field, value in fields if value and value.strip()]
+
+    def _add(self, pos: int, field: str, value: str):
+        self._exact.setdefault(value, set()).add((pos, field))
+
+        key = normalize_text(value)
+        if not key:
+            return
+        self._normalized.setdefault(key, set()).add((pos, field))
+
+        key_id = len(self._keys)
+        self._keys.append((key, pos, field))
+        for gram in _bigrams(key):
+            self._bigram_index.setdefault(gram, set()).add(key_id)
+
+    def lookup(self, description: str) -> List[IndexMatch]:
+        """返回按得分降序排列的候选（每个元素只保留最高分）"""
+        best: Dict[int, IndexMatch] = {}
+
+        def offer(pos: int, score: float, field: str, kind: str, role: str = ''):
+            if role and not _role_matches(self.elements[pos], role):
+                return
+            current = best.get(pos)
+            if current is None or score > current.score:
+                best[pos] = IndexMatch(self.elements[pos], score, field, kind)
+
+        raw = description.strip()
+        for pos, field in self._exact.get(raw, ()):
+            offer(pos, self.EXACT_SCORE, field, 'exact')
+
+        # 完整描述不限控件类型；去掉后缀的描述只匹配后缀所指的控件类型
+        key = normalize_text(raw)
+        stripped, role = _split_role_suffix(key)
+        queries = {key: ''}
+        if role:
+            queries[stripped] = role
+        queries.pop('', None)
+        for query, role in queries.items():
+            for pos, field in self._normalized.get(query, ()):
+                offer(pos, self.NORMALIZED_SCORE, field, 'normalized', role)
+
+        for query, role in queries.items():
+            if len(query) < self.FUZZY_MIN_LEN:
+                continue
+            key_ids = set()
+            for gram in _bigrams(query):
+                key_ids |= self._bigram_index.get(gram, set())
+            for key_id in key_ids:
+                value, pos, field = self._keys[key_id]
+                ratio = SequenceMatcher(None, query, value).ratio()
+                offer(pos, ratio * self.FUZZY_WEIGHT, field, 'fuzzy', role)
+
+        return sorted(best.values(), key=lambda m: m.score, reverse=True)
+
+    def resolve(self, description: str, threshold: float = 0.85, margin: float = 0.05) -> Optional[object]:
+        """唯一命中时返回元素，否则返回 None（交给 VLM 判断）"""
+        if POSITIONAL_RE.search(description):
+            return None
+
+        matches = self.lookup(description)
+        if not matches or matches[0].score < threshold:
+            return None
+
+        top = [m.element for m in matches if m.score >= matches[0].score - margin]
+        top = self._collapse_nested(top)
+        if len(top) != 1:
+            return None
+        return top[0]
+
+    @staticmethod
+    def _collapse_nested(elements: List) -> List:
+        """互相嵌套的候选指向同一个目标（如可点击行和其中的标题），只保留一个"""
+        groups: List[List] = []
+        for elem in elements:
+            for group in groups:
+                if any(_contains(elem.bounds, other.bounds) or _contains(other.bounds, elem.bounds)
+                       for other in group):
+                    group.append(elem)
+                    break
+            else:
+                groups.append([elem])
+
+        result = []
+        for group in groups:
+            clickable = [e for e in group if e.clickable]
+            result.append(clickable[0] if clickable else group[0])
+        return result
+
+
+def _contains(outer: Tuple[int, int, int, int], inner: Tuple[int, int, int, int]) -> bool:
+    return (outer[0] <= inner[0] and outer[1] <= inner[1]
+            and outer[2] >= inner[2] and outer[3] >= inner[3])
@@ -0,0 +1,165 @@
+"""紧凑的 UI 元素表 - 单遍流式解析 hierarchy XML"""
+from array import array
+from itertools import compress
+from typing import List, Tuple
+from xml.parsers import expat
+
+
+# 节点布尔属性压缩到一个整型位图里
+FLAG_CLICKABLE = 1
+FLAG_LONG_CLICKABLE = 1 << 1
+FLAG_CHECKABLE = 1 << 2
+FLAG_FOCUSABLE = 1 << 3
+FLAG_SCROLLABLE = 1 << 4
+FLAG_CHECKED = 1 << 5
+FLAG_SELECTED = 1 << 6
+FLAG_FOCUSED = 1 << 7
+FLAG_HAS_CONTENT = 1 << 8  # text 或 content-desc 非空
+
+FLAG_INTERACTIVE = FLAG_CLICKABLE | FLAG_LONG_CLICKABLE | FLAG_CHECKABLE | FLAG_FOCUSABLE
+
+_BOOL_ATTRS = (
+    ('clickable', FLAG_CLICKABLE),
+    ('long-clickable', FLAG_LONG_CLICKABLE),
+    ('checkable', FLAG_CHECKABLE),
+    ('focusable', FLAG_FOCUSABLE),
+    ('scrollable', FLAG_SCROLLABLE),
+    ('checked', FLAG_CHECKED),
+    ('selected', FLAG_SELECTED),
+    ('focused', FLAG_FOCUSED),
+)
+
+
+def parse_bounds(bounds_str: str) -> Tuple[int, int, int, int]:
+    """解析 bounds 字符串 [x1,y1][x2,y2]"""
+    try:
+        x1, y1, x2, y2 = bounds_str[1:-1].replace('][', ',').split(',')
+        return int(x1), int(y1), int(x2), int(y2)
+    except ValueError:
+        return (0, 0, 0, 0)
+
+
+class ElementTable:
+    """按列存储的节点表
+
+    每个节点占一行：坐标和父子关系存放在连续的整型数组里，
+    字符串属性只保留 text / content-desc / resource-id / class 四列，
+    不持有任何 XML 节点对象，解析完成后原始 XML 即可释放。
+    """
+
+    __slots__ = ('x1', 'y1', 'x2', 'y2', 'parent', 'depth', 'flags',
+                 'text', 'desc', 'resource_id', 'class_name', 'rotation', 'parse_error')
+
+    def __init__(self):
+        self.x1 = array('i')
+        self.y1 = array('i')
+        self.x2 = array('i')
+        self.y2 = array('i')
+        self.parent = array('i')  # 父节点行号，根节点为 -1
+        self.depth = array('H')
+        self.flags = array('H')
+        self.text: List[str] = []
+        self.desc: List[str] = []
+        self.resource_id: List[str] = []
+        self.class_name: List[str] = []
+        self.rotation = 0
+        self.parse_error = False
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    @classmethod
+    def from_xml(cls, xml_str: str) -> 'ElementTable':
+        """用 expat 单遍流式解析，不构建 DOM 树"""
+        table = cls()
+        stack: List[int] = []
+
+        def start(name, attrs):
+            if name == 'hierarchy':
+                table.rotation = int(attrs.get('rotation', 0) or 0)
+                return
+            if name != 'node':
+                return
+
+            x1, y1, x2, y2 = parse_bounds(attrs.get('bounds', ''))
+            flags = 0
+            for attr, bit in _BOOL_ATTRS:
+                if attrs.get(attr) == 'true':
+                    flags |= bit
+
+            text = attrs.get('text') or ''
+            desc = attrs.get('content-desc') or ''
+            if text or desc:
+                flags |= FLAG_HAS_CONTENT
+
+            row = len(table.flags)
+            table.x1.append(x1)
+            table.y1.append(y1)
+            table.x2.append(x2)
+            table.y2.append(y2)
+            table.parent.append(stack[-1] if stack else -1)
+            table.depth.append(len(stack))
+            table.flags.append(flags)
+            table.text.append(text)
+            table.desc.append(desc)
+            table.resource_id.append(attrs.get('resource-id') or '')
+            table.class_name.append(attrs.get('class') or '')
+            stack.append(row)
+
+        def end(name):
+            if name == 'node':
+                stack.pop()
+
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        try:
+            parser.Parse(xml_str, True)
+        except expat.ExpatError:
+            table.parse_error = True
+        return table
+
+    def bounds(self, row: int) -> Tuple[int, int, int, int]:
+        return (self.x1[row], self.y1[row], self.x2[row], self.y2[row])
+
+    def candidate_rows(self, screen_w: int, screen_h: int, min_size: int = 20) -> List[int]:
+        """按列批量过滤出候选行
+
+        条件：可交互或有文本内容；不是全屏容器；不是微小装饰；不在屏幕外。
+        """
+        full_w = screen_w * 0.95
+        full_h = screen_h * 0.95
+        mask = [
+            bool(f & (FLAG_INTERACTIVE | FLAG_HAS_CONTENT))
+            and not (x2 - x1 >= full_w and y2 - y1 >= full_h)
+            and x2 - x1 >= min_size and y2 - y1 >= min_size
+            and x2 >= 0 and y2 >= 0 and x1 <= screen_w and y1 <= screen_h
+            for x1, y1, x2, y2, f in zip(self.x1, self.y1, self.x2, self.y2, self.flags)
+        ]
+        return list(compress(range(len(mask)), mask))
+
+    def opaque_ratio(self, screen_w: int, screen_h: int) -> float:
+        """最大的无子节点、无文本内容的可见节点占屏幕面积的比例
+
+        WebView / SurfaceView / Flutter 等自绘内容在 UI 结构里只是一个空的叶子节点，
+        比例越大，屏幕上 UI 结构看不到的内容越多。
+        """
+        if screen_w <= 0 or screen_h <= 0:
+            return 0.0
+        parents = set(self.parent)
+        largest = 0
+        for row in self.visible_rows(screen_w, screen_h):
+            if row in parents or self.flags[row] & FLAG_HAS_CONTENT:
+                continue
+            w = min(self.x2[row], screen_w) - max(self.x1[row], 0)
+            h = min(self.y2[row], screen_h) - max(self.y1[row], 0)
+            largest = max(largest, w * h)
+        return largest / (screen_w * screen_h)
+
+    def visible_rows(self, screen_w: int, screen_h: int) -> List[int]:
+        """有面积且与屏幕相交的行"""
+        mask = [
+            x2 > x1 and y2 > y1 and x2 > 0 and y2 > 0 and x1 < screen_w and y1 < screen_h
+            for x1, y1, x2, y2 in zip(self.x1, self.y1, self.x2, self.y2)
+        ]
+        return list(compress(range(len(mask)), mask))
@@ -0,0 +1,89 @@
+"""截图到大模型的内存图片管线：缩放、单次有损编码、坐标回映射"""
+import io
+import base64
+from dataclasses import dataclass
+from typing import Tuple
+
+from PIL import Image
+
+from ..core.config_manager import get_config
+
+
+_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+    'jpg': ('JPEG', 'image/jpeg', 'jpg'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'png': ('PNG', 'image/png', 'png'),
+}
+
+
+@dataclass
+class EncodedImage:
+    """编码后的图片及其与设备坐标的换算关系"""
+    data: bytes
+    mime: str
+    ext: str
+    size: Tuple[int, int]  # 编码图尺寸 (w, h)
+    scale: float = 1.0  # 编码图像素 / 设备像素
+    offset: Tuple[int, int] = (0, 0)  # 裁剪区域左上角（设备坐标）
+
+    def to_data_url(self) -> str:
+        return f"data:{self.mime};base64,{base64.b64encode(self.data).decode('utf-8')}"
+
+    def to_device(self, x: float, y: float) -> Tuple[int, int]:
+        """把模型返回的图片坐标映射回设备坐标"""
+        return (int(x / self.scale) + self.offset[0], int(y / self.scale) + self.offset[1])
+
+    def to_device_box(self, box: Tuple[float, float, float, float]) -> Tuple[int, int, int, int]:
+        x1, y1 = self.to_device(box[0], box[1])
+        x2, y2 = self.to_device(box[2], box[3])
+        return (x1, y1, x2, y2)
+
+
+class ImagePipeline:
+    """图片只在内存中流转：设备 PIL 图 -> 缩放 -> 绘制 -> 一次编码 -> 直接发给模型
+
+    配置项：
+    - ai.image.max_side: 长边上限（像素），0 表示不缩放
+    - ai.image.format: jpeg / webp / png
+    - ai.image.quality: 有损编码质量
+    """
+
+    def __init__(self):
+        config = get_config()
+        self.max_side = int(config.get('ai.image.max_side', 1280) or 0)
+        self.format = str(config.get('ai.image.format', 'jpeg')).lower()
+        self.quality = int(config.get('ai.image.quality', 80))
+        if self.format not in _FORMATS:
+            self.format = 'jpeg'
+
+    def downscale(self, img: Image.Image, max_side: int = None) -> Tuple[Image.Image, float]:
+        """按长边上限等比缩放，返回 (图片, 缩放比例)"""
+        max_side = self.max_side if max_side is None else max_side
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        w, h = img.size
+        longest = max(w, h)
+        if not max_side or longest <= max_side:
+            return img, 1.0
+
+        scale = max_side / longest
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        return img.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0), scale
+
+    def encode(self, img: Image.Image, scale: float = 1.0,
+               offset: Tuple[int, int] = (0, 0)) -> EncodedImage:
+        """单次编码为配置的格式"""
+        pil_format, mime, ext = _FORMATS[self.format]
+        buf = io.BytesIO()
+        if pil_format == 'PNG':
+            img.save(buf, format=pil_format, compress_level=1)
+        else:
+            img.save(buf, format=pil_format, quality=self.quality)
+        return EncodedImage(buf.getvalue(), mime, ext, img.size, scale, offset)
+
+    def prepare(self, img: Image.Image) -> EncodedImage:
+        """缩放并编码（不需要绘制标记时使用）"""
+        small, scale = self.downscale(img)
+        return self.encode(small, scale)
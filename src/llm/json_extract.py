@@ -0,0 +1,213 @@
+"""模型输出中的 JSON 提取 - 单遍扫描 + 常见格式问题修复"""
+import json
+from typing import Any, List, Optional, Tuple
+
+
+_OPENERS = {'{': '}', '[': ']'}
+_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null'}
+
+
+def _balanced(text: str, start: int) -> Tuple[str, bool]:
+    """从 start 处的括号开始，按括号配对截取一个 JSON 值
+
+    字符串（单双引号）内的括号不计；输出被截断时返回到结尾并补齐缺失的右括号。
+
+    Returns:
+        (片段, 是否完整闭合)
+    """
+    stack: List[str] = []
+    quote: Optional[str] = None
+    escaped = False
+    i = start
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == quote:
+                quote = None
+        elif ch in ('"', "'"):
+            quote = ch
+        elif ch in _OPENERS:
+            stack.append(_OPENERS[ch])
+        elif ch in ('}', ']'):
+            if not stack or stack[-1] != ch:
+                return text[start:i], False
+            stack.pop()
+            if not stack:
+                return text[start:i + 1], True
+        i += 1
+
+    # 截断：补齐未闭合的字符串和括号
+    tail = (quote or '') + ''.join(reversed(stack))
+    return text[start:] + tail, False
+
+
+def repair(fragment: str) -> str:
+    """修复模型常见的非标准 JSON
+
+    - 尾随逗号：[1, 2,] / {"a": 1,}
+    - 注释：// 行注释、/* 块注释 */
+    - 单引号字符串、Python 字面量 True / False / None
+    - 未加引号的英文键名：{id: 1}
+    """
+    out: List[str] = []
+    i, n = 0, len(fragment)
+    while i < n:
+        ch = fragment[i]
+
+        if ch in ('"', "'"):
+            # 复制整个字符串，单引号字符串转换成双引号
+            j = i + 1
+            buf = []
+            while j < n and fragment[j] != ch:
+                if fragment[j] == '\\' and j + 1 < n:
+                    buf.append(fragment[j:j + 2])
+                    j += 2
+                    continue
+                buf.append('\\"' if ch == "'" and fragment[j] == '"' else fragment[j])
+                j += 1
+            body = ''.join(buf)
+            if ch == "'":
+                body = body.replace("\\'", "'")
+            out.append('"' + body + '"')
+            i = j + 1
+            continue
+
+        if ch == '/' and fragment.startswith('//', i):
+            end = fragment.find('\n', i)
+            i = n if end == -1 else end
+            continue
+        if ch == '/' and fragment.startswith('/*', i):
+            end = fragment.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            continue
+
+        if ch == ',':
+            j = i + 1
+            while j < n and fragment[j] in ' \t\r\n':
+                j += 1
+            if j >= n or fragment[j] in '}]':
+                i += 1
+                continue
+
+        if ch.isascii() and (ch.isalpha() or ch == '_'):
+            j = i
+            while j < n and fragment[j].isascii() and (fragment[j].isalnum() or fragment[j] == '_'):
+                j += 1
+            word = fragment[i:j]
+            k = j
+            while k < n and fragment[k] in ' \t':
+                k += 1
+            if k < n and fragment[k] == ':' and word not in ('true', 'false', 'null'):
+                out.append(f'"{word}"')
+            else:
+                out.append(_LITERALS.get(word, word))
+            i = j
+            continue
+
+        out.append(ch)
+        i += 1
+    return ''.join(out)
+
+
+def extract_json(text: str) -> Any:
+    """提取回答中的第一个合法 JSON 值
+
+    先整体解析；否则从左到右找第一个能配对（必要时修复）成合法 JSON 的对象或数组，
+    前后的说明文字、markdown 代码块标记都会被跳过。
+
+    Raises:
+        ValueError: 回答中没有可解析的 JSON
+    """
+    stripped = text.strip()
+    try:
+        return json.loads(stripped)
+    except json.JSONDecodeError:
+        pass
+
+    i = 0
+    while True:
+        starts = [p for p in (stripped.find('{', i), stripped.find('[', i)) if p != -1]
+        if not starts:
+            break
+        start = min(starts)
+        fragment, _ = _balanced(stripped, start)
+        for candidate in (fragment, repair(fragment)):
+            try:
+                return json.loads(candidate)
+            except json.JSONDecodeError:
+                continue
+        i = start + 1
+
+    raise ValueError(f"无法解析 JSON 响应: {text[:200]}")
+
+
+class ArrayStream:
+    """增量解析流式输出中的第一个 JSON 数组
+
+    每次 feed 一段新文本，返回这段文本里刚好完整到达的数组元素（对象或数组），
+    不必等整个回答生成完。数组之前的说明文字被跳过；元素按 extract_json 同样的规则修复。
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.closed = False
+        self._pos = 0
+        self._depth = 0
+        self._quote: Optional[str] = None
+        self._escaped = False
+        self._item_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Any]:
+        """追加一段输出，返回新完整的元素
+
+        Raises:
+            ValueError: 某个元素无法解析
+        """
+        if self.closed:
+            return []
+        self.buffer += chunk
+        items = []
+        text = self.buffer
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._depth == 0:
+                # 数组开始前的说明文字不跟踪引号（英文撇号很常见）
+                if ch == '[':
+                    self._depth = 1
+                continue
+            if self._quote:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == '\\':
+                    self._escaped = True
+                elif ch == self._quote:
+                    self._quote = None
+            elif ch in ('"', "'"):
+                self._quote = ch
+            elif ch in _OPENERS:
+                if self._depth == 1:
+                    self._item_start = i
+                self._depth += 1
+            elif ch in ('}', ']'):
+                self._depth -= 1
+                if self._depth == 1 and self._item_start is not None:
+                    items.append(self._parse(text[self._item_start:i + 1]))
+                    self._item_start = None
+                elif self._depth == 0:
+                    self.closed = True
+                    break
+        self._pos = len(text)
+        return items
+
+    @staticmethod
+    def _parse(fragment: str) -> Any:
+        for candidate in (fragment, repair(fragment)):
+            try:
+                return json.loads(candidate)
+            except json.JSONDecodeError:
+                continue
+        raise ValueError(f"无法解析数组元素: {fragment[:200]}")
@@ -0,0 +1,125 @@
+"""Set-of-Mark 标记渲染器：字体、配色、编号贴图全部缓存"""
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from ..core.config_manager import get_config
+
+
+# 高对比度配色，按元素编号轮换
+PALETTE = (
+    (230, 25, 75),
+    (0, 130, 200),
+    (60, 180, 75),
+    (245, 130, 48),
+    (145, 30, 180),
+)
+
+_font_cache: Dict[Tuple[Optional[str], int], ImageFont.ImageFont] = {}
+
+
+def load_font(size: int, font_path: Optional[str] = None) -> ImageFont.ImageFont:
+    """加载字体（进程内按大小缓存）
+
+    优先使用 ai.marks.font_path 配置的字体，否则使用 Pillow 自带的可缩放字体，
+    不依赖操作系统是否安装了 arial.ttf。
+    """
+    key = (font_path, size)
+    font = _font_cache.get(key)
+    if font is None:
+        if font_path:
+            try:
+                font = ImageFont.truetype(font_path, size)
+            except OSError:
+                print(f"[MarkRenderer] Font not found: {font_path}, using bundled font")
+        if font is None:
+            font = ImageFont.load_default(size=size)
+        _font_cache[key] = font
+    return font
+
+
+class MarkRenderer:
+    """编号标记渲染
+
+    - 字体只加载一次
+    - 每个 (编号, 颜色, 字号) 的标签预渲染成贴图，之后直接粘贴
+    - 元素表和画布参数不变时复用上一帧的整层标记，只做一次合成
+    """
+
+    LINE_WIDTH = 3
+
+    def __init__(self):
+        config = get_config()
+        self.font_path = config.get('ai.marks.font_path')
+        self.base_font_size = config.get('ai.marks.font_size', 30)
+        self._sprites: Dict[Tuple[int, int, int], Image.Image] = {}
+        self._overlay_key = None
+        self._overlay: Optional[Image.Image] = None
+
+    def font_size(self, scale: float) -> int:
+        return max(16, round(self.base_font_size * scale))
+
+    def font(self, size: int) -> ImageFont.ImageFont:
+        return load_font(size, self.font_path)
+
+    def _sprite(self, label: int, color: int, size: int) -> Image.Image:
+        key = (label, color, size)
+        sprite = self._sprites.get(key)
+        if sprite is None:
+            font = self.font(size)
+            text = str(label)
+            left, top, right, bottom = font.getbbox(text)
+            w, h = right - left, bottom - top
+            sprite = Image.new('RGBA', (w + 10, h + 10), PALETTE[color] + (255,))
+            ImageDraw.Draw(sprite).text((5 - left, 5 - top), text, fill='white', font=font)
+            self._sprites[key] = sprite
+        return sprite
+
+    def _build_overlay(self, canvas: Tuple[int, int], elements: List, scale: float,
+                       offset: Tuple[int, int]) -> Image.Image:
+        overlay = Image.new('RGBA', canvas, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(overlay)
+        size = self.font_size(scale)
+
+        for elem in elements:
+            color = elem.id % len(PALETTE)
+            b = elem.bounds
+            box = (int((b[0] - offset[0]) * scale), int((b[1] - offset[1]) * scale),
+                   int((b[2] - offset[0]) * scale), int((b[3] - offset[1]) * scale))
+            draw.rectangle(box, outline=PALETTE[color] + (255,), width=self.LINE_WIDTH)
+
+            # 标签贴在框的左上角，保证不超出画面顶部
+            sprite = self._sprite(elem.id, color, size)
+            x = max(0, box[0])
+            y = max(0, box[1] - sprite.height + 10)
+            overlay.paste(sprite, (x, y))
+        return overlay
+
+    def render(self, img: Image.Image, elements: List, scale: float = 1.0,
+               offset: Tuple[int, int] = (0, 0)) -> Image.Image:
+        """把标记层合成到 img 上（原地修改并返回）"""
+        key = (img.size, scale, offset, tuple((e.id, e.bounds) for e in elements))
+        if key != self._overlay_key:
+            self._overlay = self._build_overlay(img.size, elements, scale, offset)
+            self._overlay_key = key
+        img.paste(self._overlay, (0, 0), self._overlay)
+        return img
+
+    def render_grid(self, img: Image.Image, rows: int, cols: int) -> Image.Image:
+        """绘制编号网格（纯视觉模式），格子按从左到右、从上到下编号 1..rows*cols"""
+        draw = ImageDraw.Draw(img)
+        w, h = img.size
+        color = PALETTE[0]
+        for c in range(1, cols):
+            x = w * c // cols
+            draw.line((x, 0, x, h), fill=color, width=2)
+        for r in range(1, rows):
+            y = h * r // rows
+            draw.line((0, y, w, y), fill=color, width=2)
+
+        size = max(14, min(w // cols, h // rows) // 4)
+        for r in range(rows):
+            for c in range(cols):
+                sprite = self._sprite(r * cols + c + 1, 0, size)
+                img.paste(sprite, (w * c // cols + 2, h * r // rows + 2))
+        return img
@@ -0,0 +1,103 @@
+"""按调用点分档选择模型 - 先用快而便宜的模型，回答不可用时再升级"""
+import atexit
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from ..core.config_manager import get_config
+
+
+# 从低到高的模型档位
+TIERS = ('fast', 'max')
+
+# 各调用点的起始档位（qianwen.routing.<site> 可覆盖）
+DEFAULT_ROUTES = {
+    'locate': 'fast',
+    'verify': 'fast',
+    'query': 'fast',
+    'plan': 'fast',
+    'generate': 'fast',
+    'analyze': 'max',
+}
+
+
+class ModelRouter:
+    """模型路由
+
+    - 每个档位配置一个多模态模型和一个纯文本模型（qianwen.tiers.<tier>.model / text_model）
+    - 调用点声明起始档位，回答置信度低、解析失败或编号无效时逐档升级
+    - 按 (调用点, 档位) 记录调用次数、被采纳次数和耗时
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        self._initialized = True
+
+        config = get_config()
+        max_model = config.get('qianwen.model', 'qwen-vl-max')
+        self.models = {
+            'fast': {
+                'model': config.get('qianwen.tiers.fast.model', 'qwen-vl-plus'),
+                'text_model': config.get('qianwen.tiers.fast.text_model',
+                                         config.get('qianwen.text_model', 'qwen-turbo')),
+            },
+            'max': {
+                'model': config.get('qianwen.tiers.max.model', max_model),
+                'text_model': config.get('qianwen.tiers.max.text_model', 'qwen-max'),
+            },
+        }
+        self.routes = dict(DEFAULT_ROUTES)
+        self.routes.update(config.get('qianwen.routing', {}) or {})
+
+        self._lock = threading.Lock()
+        self.stats: Dict[tuple, Dict[str, float]] = defaultdict(lambda: {'calls': 0, 'accepted': 0, 'seconds': 0.0})
+        atexit.register(self._report)
+
+    def tiers(self, site: str) -> List[str]:
+        """调用点依次尝试的档位（从起始档位到最高档）"""
+        start = self.routes.get(site, 'max')
+        if start not in TIERS:
+            start = 'max'
+        return list(TIERS[TIERS.index(start):])
+
+    def model(self, site: str, tier: Optional[str] = None, text: bool = False) -> str:
+        tier = tier or self.tiers(site)[0]
+        return self.models[tier]['text_model' if text else 'model']
+
+    def next_tier(self, site: str, tier: str) -> Optional[str]:
+        tiers = self.tiers(site)
+        index = tiers.index(tier) if tier in tiers else len(tiers) - 1
+        return tiers[index + 1] if index + 1 < len(tiers) else None
+
+    def record(self, site: str, tier: str, accepted: bool, seconds: float):
+        with self._lock:
+            entry = self.stats[(site, tier)]
+            entry['calls'] += 1
+            entry['accepted'] += int(accepted)
+            entry['seconds'] += seconds
+
+    def summary(self) -> str:
+        parts = []
+        for (site, tier), entry in sorted(self.stats.items()):
+            calls = entry['calls']
+            parts.append(f"{site}/{tier}: {calls} call(s), {entry['accepted'] / calls:.0%} accepted, "
+                         f"avg {entry['seconds'] / calls:.2f}s")
+        return "; ".join(parts)
+
+    def _report(self):
+        if self.stats:
+            print(f"[ModelRouter] {self.summary()}")
+
+
+def get_router() -> ModelRouter:
+    """获取模型路由实例"""
+    return ModelRouter()
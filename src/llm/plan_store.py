@@ -0,0 +1,160 @@
+"""AI Do 规划结果存储 - 相同指令在同一应用版本上直接复用已校验的步骤"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Set
+
+from ..core.config_manager import get_config
+
+
+def normalize_instruction(instruction: str) -> str:
+    """全角转半角、小写、合并空白、去掉结尾标点"""
+    text = unicodedata.normalize('NFKC', instruction).lower()
+    text = ' '.join(text.split())
+    return text.rstrip('。.!！;；,，')
+
+
+class PlanStore:
+    """规划步骤存储（SQLite）
+
+    - 键：规范化后的指令 + 应用包名 + 应用版本，应用升级后自动重新规划
+    - 只保存通过结构校验的步骤，并记录每个规划的成功/失败次数
+    - 执行失败的规划立即失效，下次重新调用模型
+    - ai.plans.mode: readwrite / readonly（CI 只读，失效只在本进程内生效）/ off
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        self._initialized = True
+
+        config = get_config()
+        self.mode = config.get('ai.plans.mode', 'readwrite')
+        self.path = config.get('ai.plans.path', '.cache/plans.db')
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._invalid: Set[str] = set()
+
+    @staticmethod
+    def key(instruction: str, package: str, version: str) -> str:
+        raw = '\0'.join((normalize_instruction(instruction), package or '', version or ''))
+        return hashlib.blake2b(raw.encode('utf-8'), digest_size=20).hexdigest()
+
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        if self.mode == 'off':
+            return None
+        if self._db is None:
+            try:
+                if self.mode == 'readonly':
+                    if not os.path.exists(self.path):
+                        return None
+                    self._db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+                else:
+                    os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                    self._db = sqlite3.connect(self.path, check_same_thread=False)
+                    self._db.execute(
+                        "CREATE TABLE IF NOT EXISTS plans ("
+                        "key TEXT PRIMARY KEY, instruction TEXT, package TEXT, version TEXT, "
+                        "steps TEXT, valid INTEGER, successes INTEGER, failures INTEGER, "
+                        "created REAL, last_used REAL)")
+                    self._db.commit()
+            except sqlite3.Error as e:
+                print(f"[PlanStore] Store unavailable: {e}")
+                self.mode = 'off'
+                return None
+        return self._db
+
+    def get(self, instruction: str, package: str, version: str) -> Optional[List[Dict]]:
+        """取出有效的规划，没有返回 None"""
+        key = self.key(instruction, package, version)
+        if key in self._invalid:
+            return None
+        with self._lock:
+            db = self._conn()
+            if db is None:
+                return None
+            try:
+                row = db.execute("SELECT steps FROM plans WHERE key = ? AND valid = 1", (key,)).fetchone()
+            except sqlite3.Error as e:
+                print(f"[PlanStore] Read failed: {e}")
+                return None
+        return json.loads(row[0]) if row else None
+
+    def invalidated(self, instruction: str, package: str, version: str) -> bool:
+        """该指令的规划是否因执行失败而失效（重新规划时应绕过响应缓存）"""
+        key = self.key(instruction, package, version)
+        if key in self._invalid:
+            return True
+        with self._lock:
+            db = self._conn()
+            if db is None:
+                return False
+            try:
+                row = db.execute("SELECT 1 FROM plans WHERE key = ? AND valid = 0", (key,)).fetchone()
+            except sqlite3.Error as e:
+                print(f"[PlanStore] Read failed: {e}")
+                return False
+        return row is not None
+
+    def put(self, instruction: str, package: str, version: str, steps: List[Dict]):
+        """保存新规划（替换已失效的旧规划，成功/失败计数保留）"""
+        if self.mode != 'readwrite':
+            return
+        key = self.key(instruction, package, version)
+        self._invalid.discard(key)
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            if db is None:
+                return
+            try:
+                db.execute(
+                    "INSERT INTO plans VALUES (?, ?, ?, ?, ?, 1, 0, 0, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET steps = excluded.steps, valid = 1, "
+                    "created = excluded.created, last_used = excluded.last_used",
+                    (key, instruction, package, version, json.dumps(steps, ensure_ascii=False), now, now))
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"[PlanStore] Write failed: {e}")
+
+    def record(self, instruction: str, package: str, version: str, success: bool):
+        """记录一次执行结果；失败时使该规划失效"""
+        key = self.key(instruction, package, version)
+        if not success:
+            self._invalid.add(key)
+        if self.mode != 'readwrite':
+            return
+        with self._lock:
+            db = self._conn()
+            if db is None:
+                return
+            try:
+                if success:
+                    db.execute("UPDATE plans SET successes = successes + 1, last_used = ? WHERE key = ?",
+                               (time.time(), key))
+                else:
+                    # 规划还没保存（如流式规划中途失败）也要记下失效，下一个进程才会绕过响应缓存
+                    db.execute(
+                        "INSERT INTO plans VALUES (?, ?, ?, ?, '[]', 0, 0, 1, ?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET failures = failures + 1, valid = 0",
+                        (key, instruction, package, version, time.time(), time.time()))
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"[PlanStore] Write failed: {e}")
+
+
+def get_plan_store() -> PlanStore:
+    """获取规划存储实例"""
+    return PlanStore()
@@ -1,32 +1,53 @@
 """千问多模态 VL 客户端"""
-import json
+import time
+import queue
 import base64
-from typing import Optional, Union
+import asyncio
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional, Union
 from pathlib import Path
 
 try:
-    from dashscope import MultiModalConversation
+    from dashscope import MultiModalConversation, Generation
     import dashscope
 except ImportError:
     MultiModalConversation = None
+    Generation = None
     dashscope = None
 
+from .qianwen_transport import (
+    get_transport, QianwenAPIError, MULTIMODAL_PATH, TEXT_PATH,
+)
+from .response_cache import get_response_cache, image_digest
+from .resilience import get_resilience, estimate_tokens
+from .model_router import get_router
+from .json_extract import extract_json
+from .response_schema import validate
 from ..core.config_manager import get_config
 
 
-class QianwenClient:
-    """千问 VL 多模态客户端"""
-    
+class AsyncQianwenClient:
+    """千问异步客户端
+
+    安装了 httpx 时直接调用 DashScope HTTP 接口（连接池长连接、按请求超时）；
+    否则退回 dashscope SDK，在线程池中执行。两种方式都受 qianwen.max_in_flight 限制。
+    请求链路：响应缓存 -> 相同请求合并 -> 熔断/重试/对冲 -> 限流 -> 传输层。
+    """
+
     def __init__(self, api_key: Optional[str] = None):
         config = get_config()
         self.api_key = api_key or config.get('qianwen.api_key', '')
         self.model = config.get('qianwen.model', 'qwen-vl-max')
+        self.text_model = config.get('qianwen.text_model', 'qwen-turbo')
         self.timeout = config.get('qianwen.timeout', 60)
-        
+        self.transport = get_transport()
+        self.cache = get_response_cache()
+        self.guard = get_resilience()
+
         if dashscope:
             dashscope.api_key = self.api_key
-    
-    def _encode_image(self, image_data: Union[str, bytes, Path]) -> str:
+
+    @staticmethod
+    def _encode_image(image_data: Union[str, bytes, Path]) -> str:
         """编码图片为 base64"""
         if isinstance(image_data, Path):
             with open(image_data, 'rb') as f:
@@ -37,103 +58,359 @@ class QianwenClient:
             # 假设已经是 base64
             return image_data
         return ""
-    
-    def generate(self, prompt: str, image_path: str = None) -> str:
+
+    def _image_url(self, image) -> str:
+        """内存图片转为 data URL"""
+        if hasattr(image, 'to_data_url'):
+            return image.to_data_url()
+        return f'data:image/png;base64,{self._encode_image(image)}'
+
+    def _content(self, prompt: str, image_path: str = None, image=None) -> list:
+        content = []
+        if image is not None:
+            content.append({'image': self._image_url(image)})
+        elif image_path:
+            if self.transport.http_available:
+                # HTTP 接口不能读本地文件，读出来按 data URL 发送
+                content.append({'image': self._image_url(Path(image_path))})
+            else:
+                # DashScope Python SDK 支持直接传 file:// 路径
+                content.append({'image': f'file://{Path(image_path).absolute()}'})
+        content.append({'text': prompt})
+        return content
+
+    @staticmethod
+    def _usage(body: dict) -> Optional[int]:
+        usage = body.get('usage') or {}
+        if 'total_tokens' in usage:
+            return usage['total_tokens']
+        if 'input_tokens' in usage:
+            return usage['input_tokens'] + usage.get('output_tokens', 0)
+        return None
+
+    async def _multimodal(self, content: list, model: str = None, timeout: float = None,
+                          tokens: int = 0) -> str:
+        model = model or self.model
+        messages = [{'role': 'user', 'content': content}]
+        await self.guard.limiter.acquire(tokens)
+
+        if self.transport.http_available:
+            body = await self.transport.post(
+                MULTIMODAL_PATH, {'model': model, 'input': {'messages': messages}},
+                self.api_key, timeout or self.timeout)
+            self.guard.limiter.settle(tokens, self._usage(body))
+            return body['output']['choices'][0]['message']['content'][0]['text']
+
+        if not MultiModalConversation:
+            raise ImportError("dashscope 未安装，请运行: pip install dashscope")
+        response = await self.transport.call_blocking(
+            MultiModalConversation.call, model=model, messages=messages, timeout=timeout or self.timeout)
+        if response.status_code == 200:
+            return response.output.choices[0].message.content[0]['text']
+        raise QianwenAPIError(response.status_code, response.code, response.message)
+
+    @staticmethod
+    def accepted(response: str, accept: Optional[Callable[[str], Any]] = None) -> bool:
+        """回答是否可用：accept 返回非 None 且不抛出 ValueError/TypeError/KeyError；不传 accept 时非空即可用"""
+        if accept is None:
+            return bool(response and response.strip())
+        try:
+            return accept(response) is not None
+        except (ValueError, TypeError, KeyError):
+            return False
+
+    async def _cache_get(self, site: str, key: str) -> Optional[str]:
+        """查响应缓存：内存命中直接返回，SQLite 读取放进线程池，不阻塞共享的事件循环"""
+        response = self.cache.peek(site, key)
+        if response is not None or not self.cache.uses_disk(site):
+            return response
+        return await asyncio.get_running_loop().run_in_executor(None, self.cache.get, site, key)
+
+    async def _cache_put(self, site: str, key: str, response: str):
+        """写响应缓存，SQLite 写入放进线程池"""
+        if not self.cache.uses_disk(site):
+            self.cache.put(site, key, response)
+            return
+        await asyncio.get_running_loop().run_in_executor(None, self.cache.put, site, key, response)
+
+    async def _cached(self, site: str, key: str, call, accept: Optional[Callable[[str], Any]] = None,
+                      use_cache: bool = True) -> str:
+        """先查响应缓存；未命中时与同时在途的相同请求合并，只发一次
+
+        只缓存调用方 accept 接受的回答，不可用的回答（无效编号、解析失败等）不会被重放；
+        use_cache=False（显式重试）时跳过读缓存。
+        """
+        if use_cache:
+            response = await self._cache_get(site, key)
+            if response is not None:
+                return response
+
+        async def fetch():
+            result = await call()
+            if self.accepted(result, accept):
+                await self._cache_put(site, key, result)
+            return result
+
+        return await self.transport.coalesce(key, fetch)
+
+    async def generate(self, prompt: str, image_path: str = None, image=None,
+                       model: str = None, timeout: float = None, site: str = 'default',
+                       accept: Callable[[str], Any] = None, use_cache: bool = True) -> str:
         """调用通义千问 VL 模型
         
         Args:
             prompt: 提示词
             image_path: 图片路径（本地文件路径，str）
+            image: 内存中的图片（EncodedImage 或 PNG bytes），直接以 base64 发送，不落盘
+            model: 模型名，默认 qianwen.model
+            timeout: 本次请求超时（秒），默认 qianwen.timeout
+            site: 调用点名称（locate / verify / query / plan / generate / analyze），用于分别配置缓存
+            accept: 判断回答是否可用，只有可用的回答写入缓存（见 accepted）
+            use_cache: False 时不读缓存（重试同一请求）
         """
-        if not MultiModalConversation:
+        model = model or self.model
+        key = self.cache.key(model, prompt, image_digest(image if image is not None else image_path))
+        content = self._content(prompt, image_path, image)
+        tokens = estimate_tokens(prompt, image)
+        call = lambda: self.guard.call(lambda: self._multimodal(content, model, timeout, tokens))
+        return await self._cached(site, key, call, accept, use_cache)
+
+    async def generate_text(self, prompt: str, model: str = None, timeout: float = None,
+                            site: str = 'default', accept: Callable[[str], Any] = None,
+                            use_cache: bool = True) -> str:
+        """调用纯文本模型（无图片的轻量任务，比 VL 模型更快更便宜）"""
+        model = model or self.text_model
+        tokens = estimate_tokens(prompt)
+        call = lambda: self.guard.call(lambda: self._text(prompt, model, timeout, tokens))
+        return await self._cached(site, self.cache.key(model, prompt), call, accept, use_cache)
+
+    async def _text(self, prompt: str, model: str, timeout: float = None, tokens: int = 0) -> str:
+        messages = [{'role': 'user', 'content': prompt}]
+        await self.guard.limiter.acquire(tokens)
+
+        if self.transport.http_available:
+            body = await self.transport.post(
+                TEXT_PATH, {'model': model, 'input': {'messages': messages},
+                            'parameters': {'result_format': 'message'}},
+                self.api_key, timeout or self.timeout)
+            self.guard.limiter.settle(tokens, self._usage(body))
+            return body['output']['choices'][0]['message']['content']
+
+        if not Generation:
             raise ImportError("dashscope 未安装，请运行: pip install dashscope")
-        
-        content = []
-        if image_path:
-            # DashScope Python SDK 支持直接传 file:// 路径
-            # 或者我们可以手动转 base64
-            # 官方文档建议直接传路径：file://path/to/image.png
-            abs_path = Path(image_path).absolute()
-            content.append({'image': f'file://{str(abs_path)}'})
-            
-        content.append({'text': prompt})
-        
-        messages = [
-            {
-                'role': 'user',
-                'content': content
-            }
-        ]
-        
-        response = MultiModalConversation.call(
-            model=self.model,
-            messages=messages,
-        )
-        
+        response = await self.transport.call_blocking(
+            Generation.call, model=model, messages=messages, result_format='message',
+            timeout=timeout or self.timeout)
         if response.status_code == 200:
-            return response.output.choices[0].message.content[0]['text']
-        else:
-            raise Exception(f"千问 API 调用失败: {response.code} - {response.message}")
-    
-    def analyze_image(self, prompt: str, image_data: Union[str, bytes, Path]) -> str:
+            return response.output.choices[0].message.content
+        raise QianwenAPIError(response.status_code, response.code, response.message)
+
+    async def stream_text(self, prompt: str, model: str = None, timeout: float = None,
+                          site: str = 'default', accept: Callable[[str], Any] = None,
+                          use_cache: bool = True) -> AsyncIterator[str]:
+        """流式调用纯文本模型，逐段产出增量文本
+        
+        完整且被 accept 接受的回答写入响应缓存，缓存命中时一次产出全部文本。已经产出的内容无法撤回，
+        所以流式请求不重试、不对冲，失败直接抛给调用方（仍受限流和熔断约束）；
+        未安装 httpx 时退回一次性返回。
+        """
+        model = model or self.text_model
+        key = self.cache.key(model, prompt)
+        cached = await self._cache_get(site, key) if use_cache else None
+        if cached is not None:
+            yield cached
+            return
+        if not self.transport.http_available:
+            yield await self.generate_text(prompt, model, timeout, site, accept, use_cache)
+            return
+
+        tokens = estimate_tokens(prompt)
+        payload = {'model': model, 'input': {'messages': [{'role': 'user', 'content': prompt}]},
+                   'parameters': {'result_format': 'message', 'incremental_output': True}}
+        await self.guard.limiter.acquire(tokens)
+        self.guard.breaker.check()
+        parts, usage = [], None
+        try:
+            async for body in self.transport.stream(TEXT_PATH, payload, self.api_key, timeout or self.timeout):
+                usage = self._usage(body) or usage
+                delta = body['output']['choices'][0]['message']['content']
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except (asyncio.CancelledError, GeneratorExit):
+            self.guard.breaker.abandon()
+            raise
+        except Exception as e:
+            if self.guard.retryable(e):
+                self.guard.breaker.record_failure()
+            else:
+                self.guard.breaker.record_success()
+            raise
+        self.guard.breaker.record_success()
+        self.guard.limiter.settle(tokens, usage)
+        response = ''.join(parts)
+        if self.accepted(response, accept):
+            await self._cache_put(site, key, response)
+
+    async def analyze_image(self, prompt: str, image_data: Union[str, bytes, Path],
+                            model: str = None, timeout: float = None, site: str = 'analyze',
+                            accept: Callable[[str], Any] = None) -> str:
         """分析图片（多模态）"""
-        if not MultiModalConversation:
-            raise ImportError("dashscope 未安装，请运行: pip install dashscope")
+        model = model or self.model
+        key = self.cache.key(model, prompt, image_digest(image_data))
+        content = [{'image': self._image_url(image_data)}, {'text': prompt}]
+        tokens = estimate_tokens(prompt, image_data)
+        call = lambda: self.guard.call(lambda: self._multimodal(content, model, timeout, tokens))
+        return await self._cached(site, key, call, accept)
+
+
+class QianwenClient:
+    """千问 VL 多模态客户端（同步门面）
+
+    请求在传输层的后台事件循环中执行；需要并发时用 generate_many，
+    或者直接 await self.aio 上的异步接口。
+    模型按调用点路由（见 ModelRouter），ask() 在回答不可用时自动升级到更强的模型。
+    """
+    
+    def __init__(self, api_key: Optional[str] = None):
+        self.aio = AsyncQianwenClient(api_key)
+        self.transport = self.aio.transport
+        self.router = get_router()
+        self.api_key = self.aio.api_key
+        self.model = self.aio.model
+        self.text_model = self.aio.text_model
+        self.timeout = self.aio.timeout
+    
+    def _image_url(self, image) -> str:
+        return self.aio._image_url(image)
+    
+    def generate(self, prompt: str, image_path: str = None, image=None, site: str = 'default',
+                 tier: str = None, accept: Callable[[str], Any] = None, use_cache: bool = True) -> str:
+        """调用通义千问 VL 模型
         
-        image_base64 = self._encode_image(image_data)
+        Args:
+            prompt: 提示词
+            image_path: 图片路径（本地文件路径，str）
+            image: 内存中的图片（EncodedImage 或 PNG bytes），直接以 base64 发送，不落盘
+            site: 调用点名称，决定缓存配置和默认模型档位
+            tier: 模型档位（fast / max），默认取调用点的起始档位
+            accept: 判断回答是否可用，只有可用的回答写入缓存
+            use_cache: False 时不读缓存（重试同一请求）
+        """
+        model = self.router.model(site, tier)
+        return self.transport.run(self.aio.generate(prompt, image_path, image, model=model, site=site,
+                                                    accept=accept, use_cache=use_cache))
+    
+    def generate_text(self, prompt: str, model: str = None, site: str = 'default', tier: str = None,
+                      accept: Callable[[str], Any] = None, use_cache: bool = True) -> str:
+        """调用纯文本模型（无图片的轻量任务，比 VL 模型更快更便宜）
         
-        messages = [
-            {
-                'role': 'user',
-                'content': [
-                    {'image': f'data:image/png;base64,{image_base64}'},
-                    {'text': prompt}
-                ]
-            }
-        ]
+        Args:
+            prompt: 提示词
+            model: 模型名，默认按调用点和档位路由
+            site: 调用点名称，决定缓存配置和默认模型档位
+            tier: 模型档位（fast / max）
+            accept: 判断回答是否可用，只有可用的回答写入缓存
+            use_cache: False 时不读缓存（重试同一请求）
+        """
+        model = model or self.router.model(site, tier, text=True)
+        return self.transport.run(self.aio.generate_text(prompt, model, site=site, accept=accept,
+                                                         use_cache=use_cache))
+    
+    def stream_text(self, prompt: str, model: str = None, site: str = 'default',
+                    tier: str = None, accept: Callable[[str], Any] = None,
+                    use_cache: bool = True, drain: bool = False) -> Iterator[str]:
+        """流式调用纯文本模型，逐段返回增量文本
         
-        response = MultiModalConversation.call(
-            model=self.model,
-            messages=messages,
-        )
+        生成在后台事件循环中进行，调用方处理已到达的内容时后面的内容继续生成；
+        提前结束迭代会取消请求。
         
-        if response.status_code == 200:
-            return response.output.choices[0].message.content[0]['text']
-        else:
-            raise Exception(f"千问 API 调用失败: {response.code} - {response.message}")
-    
-    def parse_json_response(self, response: str) -> dict:
-        """解析 JSON 响应"""
-        # 尝试提取 JSON
+        Args:
+            drain: 提前结束迭代时不取消，后台继续读到流结束（调用方已拿到所需内容，
+                只剩结束事件），回答照常写入缓存、结算限流和熔断
+        """
+        model = model or self.router.model(site, tier, text=True)
+        chunks: queue.Queue = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for delta in self.aio.stream_text(prompt, model, site=site, accept=accept,
+                                                        use_cache=use_cache):
+                    chunks.put(delta)
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                chunks.put(done)
+
+        future = self.transport.submit(pump())
         try:
-            # 直接解析
-            return json.loads(response)
-        except json.JSONDecodeError:
-            pass
+            while True:
+                item = chunks.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            if not drain:
+                future.cancel()
+    
+    def analyze_image(self, prompt: str, image_data: Union[str, bytes, Path], site: str = 'analyze') -> str:
+        """分析图片（多模态）"""
+        model = self.router.model(site)
+        return self.transport.run(self.aio.analyze_image(prompt, image_data, model=model, site=site))
+    
+    def ask(self, prompt: str, accept: Callable[[str], Any], image=None, site: str = 'default',
+            text: bool = False, use_cache: bool = True) -> Any:
+        """按调用点的档位依次调用模型，直到 accept 接受回答
         
-        # 尝试从 markdown 代码块提取
-        import re
-        json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', response)
-        if json_match:
-            try:
-                return json.loads(json_match.group(1))
-            except json.JSONDecodeError:
-                pass
+        Args:
+            accept: 把回答转换成结果；返回 None 或抛出 ValueError/TypeError/KeyError 表示不可用，升级到下一档
+            text: 使用纯文本模型
+            use_cache: False 时不读缓存（重试同一请求）；只有被 accept 接受的回答写入缓存
         
-        # 尝试查找 JSON 对象
-        json_match = re.search(r'\{[\s\S]*\}', response)
-        if json_match:
+        Returns:
+            accept 的返回值；所有档位都不可用时抛出 ValueError
+        """
+        last_error = None
+        for tier in self.router.tiers(site):
+            started = time.time()
+            if text:
+                response = self.generate_text(prompt, site=site, tier=tier, accept=accept, use_cache=use_cache)
+            else:
+                response = self.generate(prompt, image=image, site=site, tier=tier, accept=accept,
+                                         use_cache=use_cache)
             try:
-                return json.loads(json_match.group())
-            except json.JSONDecodeError:
-                pass
+                result = accept(response)
+            except (ValueError, TypeError, KeyError) as e:
+                result, last_error = None, e
+            self.router.record(site, tier, result is not None, time.time() - started)
+            if result is not None:
+                return result
+            if self.router.next_tier(site, tier):
+                print(f"[QianwenClient] {site}: {tier} answer not usable, escalating")
+        raise ValueError(f"模型回答不可用: {last_error or response[:200]}")
+    
+    def generate_many(self, prompts: List[str], image=None, text_only: bool = False,
+                      site: str = 'default') -> List[str]:
+        """并发发出多个请求，按输入顺序返回结果（在途数量受 qianwen.max_in_flight 限制）"""
+        model = self.router.model(site, text=text_only)
+        if text_only:
+            futures = [self.transport.submit(self.aio.generate_text(p, model, site=site)) for p in prompts]
+        else:
+            futures = [self.transport.submit(self.aio.generate(p, image=image, model=model, site=site))
+                       for p in prompts]
+        return [f.result() for f in futures]
+    
+    def parse_json_response(self, response: str, schema: str = None) -> Any:
+        """解析 JSON 响应
         
-        # 尝试查找 JSON 数组
-        json_match = re.search(r'\[[\s\S]*\]', response)
-        if json_match:
-            try:
-                return json.loads(json_match.group())
-            except json.JSONDecodeError:
-                pass
+        单遍提取第一个合法的 JSON 值（跳过说明文字和代码块标记，修复尾随逗号等常见问题）；
+        指定 schema（plan / verify / query / locate 等）时再按调用点校验并规整结构。
         
-        raise ValueError(f"无法解析 JSON 响应: {response[:200]}")
+        Raises:
+            ValueError: 没有可解析的 JSON，或结构不符合 schema（SchemaError）
+        """
+        value = extract_json(response)
+        return validate(schema, value) if schema else value
@@ -0,0 +1,184 @@
+"""千问 HTTP 传输层 - 后台事件循环 + 连接池"""
+import json
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Awaitable, Callable, Coroutine, Dict, Optional
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from ..core.config_manager import get_config
+
+
+MULTIMODAL_PATH = '/api/v1/services/aigc/multimodal-generation/generation'
+TEXT_PATH = '/api/v1/services/aigc/text-generation/generation'
+
+
+class QianwenAPIError(Exception):
+    """千问接口返回错误（status 为 HTTP 状态码，code 为接口错误码）"""
+
+    def __init__(self, status: int, code: str = '', message: str = ''):
+        super().__init__(f"千问 API 调用失败: {status} {code} - {message}")
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+class QianwenTransport:
+    """进程内共享的异步传输层
+
+    - 一个后台线程运行 asyncio 事件循环，同步代码通过 run()/submit() 把协程交给它
+    - httpx.AsyncClient 连接池保持长连接，所有客户端实例、所有设备共用
+    - 信号量限制同时在途的请求数（qianwen.max_in_flight）
+    - 相同请求（模型 + 提示词 + 图片摘要）同时在途时只发一次，结果共享给所有调用方
+    - qianwen.endpoint 可指向本地替身服务，便于测试
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        self._initialized = True
+
+        config = get_config()
+        self.endpoint = config.get('qianwen.endpoint', 'https://dashscope.aliyuncs.com').rstrip('/')
+        self.timeout = config.get('qianwen.timeout', 60)
+        self.max_in_flight = int(config.get('qianwen.max_in_flight', 8))
+        self.keepalive = int(config.get('qianwen.keepalive', self.max_in_flight))
+
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._client = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+
+    @property
+    def http_available(self) -> bool:
+        return httpx is not None
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=loop.run_forever, name='qianwen-loop', daemon=True)
+                self._thread.start()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coro: Coroutine) -> Future:
+        """把协程交给后台事件循环，立即返回 Future，可同时提交多个"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def run(self, coro: Coroutine) -> Any:
+        """同步等待协程结果（同步门面使用）"""
+        if self._thread is not None and threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("不能在传输层事件循环内同步等待，请直接 await 异步接口")
+        return self.submit(coro).result()
+
+    def slot(self) -> asyncio.Semaphore:
+        """在途请求信号量（只能在事件循环线程内调用）"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphore
+
+    async def coalesce(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """单飞：同一 key 的请求在途时直接等待它的结果，不再重复发送
+
+        共享的请求用 shield 保护，某个调用方超时或取消不会影响其他等待者。
+        """
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+
+    def _http(self):
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.max_in_flight,
+                                  max_keepalive_connections=self.keepalive)
+            self._client = httpx.AsyncClient(base_url=self.endpoint, limits=limits, timeout=self.timeout)
+        return self._client
+
+    async def post(self, path: str, payload: dict, api_key: str, timeout: Optional[float] = None) -> dict:
+        """POST JSON 到千问接口，返回响应 JSON；非 200 抛出 QianwenAPIError"""
+        headers = {'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'}
+        async with self.slot():
+            response = await self._http().post(path, json=payload, headers=headers,
+                                               timeout=timeout or self.timeout)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        if response.status_code != 200:
+            raise QianwenAPIError(response.status_code, body.get('code', ''),
+                                  body.get('message', response.text[:200]))
+        return body
+
+    async def stream(self, path: str, payload: dict, api_key: str,
+                     timeout: Optional[float] = None) -> AsyncIterator[dict]:
+        """以 SSE 方式 POST，逐个产出事件的 data JSON；错误状态或 error 事件抛出 QianwenAPIError"""
+        headers = {'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json',
+                   'Accept': 'text/event-stream', 'X-DashScope-SSE': 'enable'}
+        async with self.slot():
+            async with self._http().stream('POST', path, json=payload, headers=headers,
+                                           timeout=timeout or self.timeout) as response:
+                if response.status_code != 200:
+                    raw = await response.aread()
+                    try:
+                        body = json.loads(raw)
+                    except ValueError:
+                        body = {}
+                    raise QianwenAPIError(response.status_code, body.get('code', ''),
+                                          body.get('message', raw[:200].decode('utf-8', 'replace')))
+                event, status = '', 200
+                async for line in response.aiter_lines():
+                    if line.startswith('event:'):
+                        event = line[6:].strip()
+                    elif line.startswith(':HTTP_STATUS/'):
+                        status = int(line[13:].strip() or 200)
+                    elif line.startswith('data:'):
+                        body = json.loads(line[5:])
+                        if event == 'error' or status != 200:
+                            raise QianwenAPIError(status if status != 200 else 500,
+                                                  body.get('code', ''), body.get('message', ''))
+                        yield body
+
+    async def call_blocking(self, func, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """未安装 httpx 时，把阻塞的 SDK 调用放进线程池，同样受在途上限和超时约束"""
+        loop = asyncio.get_running_loop()
+        async with self.slot():
+            return await asyncio.wait_for(loop.run_in_executor(None, lambda: func(*args, **kwargs)),
+                                          timeout or self.timeout)
+
+    def close(self):
+        """关闭连接池和事件循环"""
+        if self._loop is None:
+            return
+        if self._client is not None:
+            self.run(self._client.aclose())
+            self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop = self._thread = None
+        self._semaphore = None
+
+
+def get_transport() -> QianwenTransport:
+    """获取传输层实例"""
+    return QianwenTransport()
@@ -0,0 +1,133 @@
+"""AI Query 结构化提取 - 优先从 UI 结构里读出列表数据"""
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from .element_table import ElementTable
+
+
+@dataclass
+class RowGroup:
+    """同一父节点下结构重复的一组行（如 RecyclerView 的列表项）"""
+    parent: int
+    rows: List[int]
+    columns: List[str]
+    records: List[Dict[str, str]]
+    bounds: Tuple[int, int, int, int]
+
+
+@dataclass
+class ExtractedScreen:
+    """从 UI 结构提取出的文本数据"""
+    group: Optional[RowGroup]
+    other_texts: List[str] = field(default_factory=list)
+
+    @property
+    def empty(self) -> bool:
+        return self.group is None and not self.other_texts
+
+    def to_text(self, max_other: int = 60) -> str:
+        """序列化成紧凑的文本表格"""
+        lines = []
+        if self.group:
+            lines.append(f"列表（{len(self.group.records)} 行）：")
+            lines.append("#|" + "|".join(self.group.columns))
+            for i, record in enumerate(self.group.records, start=1):
+                cells = [record.get(col, '').replace('|', '/').replace('\n', ' ') for col in self.group.columns]
+                lines.append(f"{i}|" + "|".join(cells))
+        if self.other_texts:
+            lines.append("其他文本：" + "；".join(self.other_texts[:max_other]))
+        return "\n".join(lines)
+
+
+class QueryEngine:
+    """从元素表中识别重复行结构并抽取记录"""
+
+    def __init__(self, min_rows: int = 2):
+        self.min_rows = min_rows
+
+    @staticmethod
+    def _subtree_end(table: ElementTable, row: int) -> int:
+        """子树在文档顺序中是连续的，返回子树之后的第一行"""
+        depth = table.depth[row]
+        end = row + 1
+        while end < len(table) and table.depth[end] > depth:
+            end += 1
+        return end
+
+    @staticmethod
+    def _field_name(table: ElementTable, row: int) -> str:
+        rid = table.resource_id[row]
+        if ':id/' in rid:
+            return rid.split(':id/', 1)[1]
+        return table.class_name[row].rsplit('.', 1)[-1] or 'text'
+
+    def _record(self, table: ElementTable, row: int, visible: set) -> Dict[str, str]:
+        """一行里所有可见文本，字段名取 resource-id，重名按出现顺序编号"""
+        record: Dict[str, str] = {}
+        for r in range(row, self._subtree_end(table, row)):
+            if r not in visible:
+                continue
+            value = table.text[r] or table.desc[r]
+            if not value:
+                continue
+            name = self._field_name(table, r)
+            key, n = name, 2
+            while key in record:
+                key = f"{name}_{n}"
+                n += 1
+            record[key] = value
+        return record
+
+    def extract(self, table: ElementTable, screen_w: int, screen_h: int) -> ExtractedScreen:
+        visible_rows = table.visible_rows(screen_w, screen_h)
+        visible = set(visible_rows)
+
+        children: Dict[int, List[int]] = {}
+        for row in visible_rows:
+            parent = table.parent[row]
+            if parent != -1:
+                children.setdefault(parent, []).append(row)
+
+        best: Optional[RowGroup] = None
+        best_score = 0
+        for parent, kids in children.items():
+            if len(kids) < self.min_rows:
+                continue
+            # 同一父节点下同类容器视为候选行，取出现最多的类
+            cls, count = Counter(table.class_name[k] for k in kids).most_common(1)[0]
+            if count < self.min_rows:
+                continue
+            rows = [k for k in kids if table.class_name[k] == cls]
+            records = [self._record(table, k, visible) for k in rows]
+            pairs = [(k, rec) for k, rec in zip(rows, records) if rec]
+            if len(pairs) < self.min_rows:
+                continue
+            fields = sum(len(rec) for _, rec in pairs)
+            # 每行只有一个文本的"列表"往往是菜单，多字段的行更像数据列表
+            score = fields + len(pairs) * (fields / len(pairs) - 1)
+            if score > best_score:
+                rows = [k for k, _ in pairs]
+                records = [rec for _, rec in pairs]
+                columns = list(dict.fromkeys(key for rec in records for key in rec))
+                x1 = min(table.x1[k] for k in rows)
+                y1 = min(table.y1[k] for k in rows)
+                x2 = max(table.x2[k] for k in rows)
+                y2 = max(table.y2[k] for k in rows)
+                best = RowGroup(parent, rows, columns, records, (x1, y1, x2, y2))
+                best_score = score
+
+        in_group = set()
+        if best:
+            for row in best.rows:
+                in_group.update(range(row, self._subtree_end(table, row)))
+
+        other_texts = []
+        for row in visible_rows:
+            if row in in_group:
+                continue
+            value = table.text[row] or table.desc[row]
+            if value:
+                other_texts.append(value)
+
+        return ExtractedScreen(best, list(dict.fromkeys(other_texts)))
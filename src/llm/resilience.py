@@ -0,0 +1,240 @@
+"""模型调用的限流、重试、熔断与对冲请求"""
+import time
+import random
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from .qianwen_transport import QianwenAPIError
+from ..core.config_manager import get_config
+
+
+class CircuitOpenError(Exception):
+    """熔断中，请求被直接拒绝"""
+
+
+def estimate_tokens(prompt: str, image=None, output: int = 300) -> int:
+    """粗略估算一次请求消耗的 token：提示词按字符计，图片按 28x28 像素一个 token"""
+    tokens = len(prompt) + output
+    if image is not None:
+        size = getattr(image, 'size', None)
+        tokens += size[0] * size[1] // 784 if size else 1000
+    return tokens
+
+
+class TokenBucket:
+    """令牌桶（每分钟速率，rate <= 0 表示不限）"""
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.level >= amount:
+                self.level -= amount
+                return
+            await asyncio.sleep((amount - self.level) / self.rate)
+
+    def adjust(self, delta: float):
+        """按实际用量修正（可以透支，之后的请求会等待更久）"""
+        if self.rate > 0:
+            self._refill()
+            self.level -= delta
+
+
+class RateLimiter:
+    """进程级限流：每分钟请求数 + 每分钟 token 数"""
+
+    def __init__(self, requests_per_min: float, tokens_per_min: float):
+        self.requests = TokenBucket(requests_per_min)
+        self.tokens = TokenBucket(tokens_per_min)
+
+    async def acquire(self, tokens: int):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(tokens)
+
+    def settle(self, estimated: int, actual: Optional[int]):
+        if actual is not None:
+            self.tokens.adjust(actual - estimated)
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断，冷却期内直接失败；冷却后放行一个试探请求"""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return 'half-open'
+        return 'open'
+
+    def check(self):
+        state = self.state
+        if state == 'open' or (state == 'half-open' and self._probing):
+            remaining = self.cooldown - (time.monotonic() - self.opened_at)
+            raise CircuitOpenError(f"千问服务暂不可用（熔断中，{max(0.0, remaining):.0f} 秒后重试）")
+        if state == 'half-open':
+            self._probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def abandon(self):
+        """试探请求被取消，允许下一个请求继续试探"""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.threshold:
+            if self.opened_at is None or self._probing:
+                print(f"[Resilience] Circuit opened after {self.failures} failure(s)")
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class LatencyTracker:
+    """最近请求耗时，用于计算对冲延迟"""
+
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class Resilience:
+    """进程内共享的调用保护（所有方法都在传输层的事件循环中执行）
+
+    配置项：
+    - qianwen.rate.requests_per_min / tokens_per_min: 令牌桶限流，0 表示不限
+    - qianwen.retry.max_attempts / base_delay / max_delay: 429、5xx、超时和网络错误按指数退避 + 抖动重试
+    - qianwen.breaker.threshold / cooldown: 连续失败熔断
+    - qianwen.hedge.enabled / percentile / min_samples / initial_delay: 超过 p95 耗时仍未返回时发出一个重复请求，取先返回的结果
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        self._initialized = True
+
+        config = get_config()
+        self.limiter = RateLimiter(config.get('qianwen.rate.requests_per_min', 120),
+                                   config.get('qianwen.rate.tokens_per_min', 0))
+        self.max_attempts = int(config.get('qianwen.retry.max_attempts', 4))
+        self.base_delay = config.get('qianwen.retry.base_delay', 0.5)
+        self.max_delay = config.get('qianwen.retry.max_delay', 8.0)
+        self.breaker = CircuitBreaker(int(config.get('qianwen.breaker.threshold', 5)),
+                                      config.get('qianwen.breaker.cooldown', 30.0))
+        self.hedge = config.get('qianwen.hedge.enabled', False)
+        self.hedge_percentile = config.get('qianwen.hedge.percentile', 0.95)
+        self.hedge_min_samples = int(config.get('qianwen.hedge.min_samples', 20))
+        self.hedge_initial_delay = config.get('qianwen.hedge.initial_delay', 5.0)
+        self.latency = LatencyTracker()
+        self.hedged = 0
+
+    @staticmethod
+    def retryable(error: Exception) -> bool:
+        if isinstance(error, QianwenAPIError):
+            return error.status == 429 or error.status >= 500
+        if isinstance(error, asyncio.TimeoutError):
+            return True
+        return httpx is not None and isinstance(error, (httpx.TimeoutException, httpx.TransportError))
+
+    def _hedge_delay(self) -> float:
+        if len(self.latency.samples) < self.hedge_min_samples:
+            return self.hedge_initial_delay
+        return self.latency.percentile(self.hedge_percentile)
+
+    async def _hedged(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """主请求超过 p95 耗时仍未返回时再发一个，取先成功的结果，另一个取消"""
+        primary = asyncio.ensure_future(factory())
+        done, _ = await asyncio.wait({primary}, timeout=self._hedge_delay())
+        if done:
+            return primary.result()
+
+        self.hedged += 1
+        pending = {primary, asyncio.ensure_future(factory())}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def call(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """带熔断、重试和对冲地执行一次请求（factory 每次调用都发出一个新请求）"""
+        for attempt in range(self.max_attempts):
+            self.breaker.check()
+            started = time.monotonic()
+            try:
+                result = await (self._hedged(factory) if self.hedge else factory())
+            except asyncio.CancelledError:
+                self.breaker.abandon()
+                raise
+            except Exception as e:
+                if not self.retryable(e):
+                    # 服务有响应（如参数错误），不算故障
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if attempt == self.max_attempts - 1 or self.breaker.state != 'closed':
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                print(f"[Resilience] {e}; retry {attempt + 1} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            self.latency.record(time.monotonic() - started)
+            return result
+
+
+def get_resilience() -> Resilience:
+    """获取调用保护实例"""
+    return Resilience()
@@ -0,0 +1,226 @@
+"""模型响应缓存 - 相同模型 + 提示词 + 图片直接返回上次的回答"""
+import os
+import time
+import atexit
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from collections import Counter, OrderedDict
+from typing import Dict, Optional
+
+from ..core.config_manager import get_config
+
+
+def image_digest(image) -> str:
+    """图片内容摘要：EncodedImage / bytes / 本地路径 / base64 字符串"""
+    if image is None:
+        return ''
+    if hasattr(image, 'data'):
+        data = image.data
+    elif isinstance(image, bytes):
+        data = image
+    elif isinstance(image, Path) or (isinstance(image, str) and os.path.isfile(image)):
+        with open(image, 'rb') as f:
+            data = f.read()
+    else:
+        data = str(image).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    """两级响应缓存
+
+    - 内存 LRU（ai.cache.memory_size 条）
+    - SQLite 磁盘缓存（ai.cache.path），按 TTL 过期，总大小超过 ai.cache.max_mb 时淘汰最久未访问的记录
+    - ai.cache.mode: readwrite / readonly（CI 只读，不写磁盘）/ memory（只用内存）/ off
+    - 按调用点单独配置：ai.cache.sites.<site>.enabled / ttl
+    - 内存和磁盘分别加锁：peek 只查内存，磁盘读写进行中也不会被阻塞
+    """
+
+    _instance = None
+
+    # 每写入多少条检查一次过期和容量
+    EVICT_EVERY = 50
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+        self._initialized = True
+
+        config = get_config()
+        self.mode = config.get('ai.cache.mode', 'readwrite')
+        self.path = config.get('ai.cache.path', '.cache/qianwen_responses.db')
+        self.ttl = config.get('ai.cache.ttl', 7 * 24 * 3600)
+        self.max_bytes = int(config.get('ai.cache.max_mb', 100)) * 1024 * 1024
+        self.memory_size = int(config.get('ai.cache.memory_size', 256))
+        self.sites: Dict[str, dict] = config.get('ai.cache.sites', {}) or {}
+
+        self.stats: Dict[str, Counter] = {}
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes = 0
+        atexit.register(self._report)
+
+    @staticmethod
+    def key(model: str, prompt: str, digest: str = '') -> str:
+        h = hashlib.blake2b(digest_size=20)
+        for part in (model, prompt, digest):
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def enabled(self, site: str) -> bool:
+        if self.mode == 'off':
+            return False
+        return self.sites.get(site, {}).get('enabled', True)
+
+    def uses_disk(self, site: str) -> bool:
+        """该调用点的查询/写入是否会访问磁盘"""
+        return self.enabled(site) and self.mode != 'memory'
+
+    def _site_ttl(self, site: str) -> float:
+        return self.sites.get(site, {}).get('ttl', self.ttl)
+
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        if self._db is None:
+            try:
+                if self.mode == 'readonly':
+                    if not os.path.exists(self.path):
+                        return None
+                    self._db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+                else:
+                    os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                    self._db = sqlite3.connect(self.path, check_same_thread=False)
+                    self._db.execute(
+                        "CREATE TABLE IF NOT EXISTS responses ("
+                        "key TEXT PRIMARY KEY, site TEXT, response TEXT, "
+                        "expires REAL, accessed REAL, size INTEGER)")
+                    self._db.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed)")
+                    self._db.commit()
+            except sqlite3.Error as e:
+                print(f"[ResponseCache] Disk cache unavailable: {e}")
+                self.mode = 'memory'
+                return None
+        return self._db
+
+    def _remember(self, key: str, response: str):
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def peek(self, site: str, key: str) -> Optional[str]:
+        """只查内存，不访问磁盘（可以直接在事件循环里调用），未命中返回 None"""
+        if not self.enabled(site):
+            return None
+        with self._lock:
+            response = self._memory.get(key)
+            if response is not None:
+                self._memory.move_to_end(key)
+                self.stats.setdefault(site, Counter())['memory'] += 1
+            return response
+
+    def get(self, site: str, key: str) -> Optional[str]:
+        """查缓存（内存未命中时读磁盘），未命中返回 None"""
+        if not self.enabled(site):
+            return None
+        response = self.peek(site, key)
+        if response is not None:
+            return response
+        now = time.time()
+
+        row = None
+        with self._db_lock:
+            db = self._conn() if self.mode != 'memory' else None
+            if db is not None:
+                try:
+                    row = db.execute("SELECT response, expires FROM responses WHERE key = ?",
+                                     (key,)).fetchone()
+                    if row and row[1] < now:
+                        row = None
+                    elif row and self.mode == 'readwrite':
+                        db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                        db.commit()
+                except sqlite3.Error as e:
+                    print(f"[ResponseCache] Read failed: {e}")
+                    row = None
+
+        with self._lock:
+            counter = self.stats.setdefault(site, Counter())
+            if row is None:
+                counter['miss'] += 1
+                return None
+            counter['disk'] += 1
+            self._remember(key, row[0])
+        return row[0]
+
+    def put(self, site: str, key: str, response: str):
+        """写入缓存（只读模式只写内存）"""
+        if not self.enabled(site) or not response:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, response)
+        if self.mode != 'readwrite':
+            return
+        with self._db_lock:
+            db = self._conn()
+            if db is None:
+                return
+            try:
+                db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                           (key, site, response, now + self._site_ttl(site), now, len(response.encode('utf-8'))))
+                db.commit()
+                self._writes += 1
+                if self._writes % self.EVICT_EVERY == 0:
+                    self._evict(db, now)
+            except sqlite3.Error as e:
+                print(f"[ResponseCache] Write failed: {e}")
+
+    def _evict(self, db: sqlite3.Connection, now: float):
+        """删除过期记录；超过容量时按最久未访问淘汰到上限的 90%"""
+        db.execute("DELETE FROM responses WHERE expires < ?", (now,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            target = total - int(self.max_bytes * 0.9)
+            freed = 0
+            victims = []
+            for key, size in db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                victims.append((key,))
+                freed += size
+                if freed >= target:
+                    break
+            db.executemany("DELETE FROM responses WHERE key = ?", victims)
+        db.commit()
+
+    def hit_rate(self, site: Optional[str] = None) -> float:
+        counters = [self.stats.get(site, Counter())] if site else list(self.stats.values())
+        hits = sum(c['memory'] + c['disk'] for c in counters)
+        total = hits + sum(c['miss'] for c in counters)
+        return hits / total if total else 0.0
+
+    def summary(self) -> str:
+        parts = []
+        for site, c in sorted(self.stats.items()):
+            total = c['memory'] + c['disk'] + c['miss']
+            parts.append(f"{site}: {self.hit_rate(site):.0%} of {total} "
+                         f"(memory {c['memory']}, disk {c['disk']})")
+        return "; ".join(parts)
+
+    def _report(self):
+        if self.stats:
+            print(f"[ResponseCache] Hit rate {self.hit_rate():.0%} - {self.summary()}")
+
+
+def get_response_cache() -> ResponseCache:
+    """获取响应缓存实例"""
+    return ResponseCache()
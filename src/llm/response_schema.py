@@ -0,0 +1,110 @@
+"""按调用点校验并规整模型回答的结构"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+# 规划结果中允许出现的操作类型，及每种操作必需的字段
+ACTIONS = {
+    'open_app': (),
+    'close_app': (),
+    'click': ('target',),
+    'input': ('target', 'text'),
+    'wait': ('condition',),
+    'verify': ('condition',),
+    'swipe': ('direction',),
+    'back': (),
+    'home': (),
+}
+
+SWIPE_DIRECTIONS = ('up', 'down', 'left', 'right')
+
+
+class SchemaError(ValueError):
+    """回答是合法 JSON，但结构不符合调用点的要求"""
+
+
+def _as_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', 'false', '是', '否'):
+        return value.strip().lower() in ('true', '是')
+    raise SchemaError(f"不是布尔值: {value!r}")
+
+
+def validate_plan(value: Any) -> List[Dict]:
+    """规划步骤：非空数组，每步的 action 已知且带齐必需字段"""
+    if isinstance(value, dict) and isinstance(value.get('steps'), list):
+        value = value['steps']
+    if not isinstance(value, list) or not value:
+        raise SchemaError("规划结果不是非空数组")
+    for step in value:
+        if not isinstance(step, dict) or step.get('action') not in ACTIONS:
+            raise SchemaError(f"无效的步骤: {step}")
+        for field in ACTIONS[step['action']]:
+            if field == 'text':
+                step.setdefault('text', '')
+            elif not step.get(field):
+                raise SchemaError(f"{step['action']} 步骤缺少 {field}: {step}")
+        if step['action'] == 'swipe' and step['direction'] not in SWIPE_DIRECTIONS:
+            raise SchemaError(f"无效的滑动方向: {step['direction']}")
+    return value
+
+
+def validate_verify(value: Any) -> Dict:
+    """断言判定：{"passed": bool, "reason": str}"""
+    if not isinstance(value, dict) or 'passed' not in value:
+        raise SchemaError(f"判定结果缺少 passed: {value}")
+    return {'passed': _as_bool(value['passed']), 'reason': str(value.get('reason') or '')}
+
+
+def validate_query(value: Any) -> Any:
+    """数据提取：任意 JSON，但不能为空"""
+    if value is None or value == '' or value == {}:
+        raise SchemaError("提取结果为空")
+    return value
+
+
+def validate_query_hierarchy(value: Any) -> Dict:
+    """基于 UI 结构的提取：{"data": ..., "missing": [...]}，旧格式整体视为 data"""
+    if not isinstance(value, dict) or 'data' not in value:
+        return {'data': value, 'missing': []}
+    missing = value.get('missing') or []
+    if not isinstance(missing, list):
+        missing = [missing]
+    return {'data': value['data'], 'missing': missing}
+
+
+def validate_locate(value: Any) -> List[Tuple[int, Optional[float]]]:
+    """定位候选：{"candidates": [{"id": 5, "confidence": 0.9}]}，兼容数组和单个编号
+
+    Returns:
+        [(编号, 置信度)]，按置信度从高到低；没有给出置信度时为 None
+    """
+    items = value.get('candidates', []) if isinstance(value, dict) else value
+    if not isinstance(items, list):
+        items = [items]
+    scored = []
+    for item in items:
+        try:
+            if isinstance(item, dict):
+                conf = item.get('confidence')
+                scored.append((int(item.get('id', -1)), None if conf is None else float(conf)))
+            else:
+                scored.append((int(item), None))
+        except (TypeError, ValueError):
+            raise SchemaError(f"无效的候选: {item!r}")
+    scored.sort(key=lambda pair: pair[1] or 0.0, reverse=True)
+    return scored
+
+
+SCHEMAS: Dict[str, Callable[[Any], Any]] = {
+    'plan': validate_plan,
+    'verify': validate_verify,
+    'query': validate_query,
+    'query_hierarchy': validate_query_hierarchy,
+    'locate': validate_locate,
+}
+
+
+def validate(schema: str, value: Any) -> Any:
+    """按名称校验并返回规整后的值"""
+    return SCHEMAS[schema](value)
@@ -64,7 +64,7 @@ steps:
 3. 步骤逻辑合理
 """
 
-        response = self.qianwen.generate(prompt)
+        response = self.qianwen.ask(prompt, lambda r: r if r.strip() else None, site='generate', text=True)
         
         # 清理响应
         script = self._clean_script(response)
@@ -0,0 +1,179 @@
+"""Set-of-Mark 候选的空间索引与合并"""
+from typing import Dict, Iterable, List, Set, Tuple
+
+from .element_table import (
+    ElementTable,
+    FLAG_CLICKABLE,
+    FLAG_LONG_CLICKABLE,
+    FLAG_CHECKABLE,
+    FLAG_HAS_CONTENT,
+)
+
+
+Box = Tuple[int, int, int, int]
+
+FLAG_ACTIONABLE = FLAG_CLICKABLE | FLAG_LONG_CLICKABLE | FLAG_CHECKABLE
+
+
+def contains(outer: Box, inner: Box) -> bool:
+    return (outer[0] <= inner[0] and outer[1] <= inner[1]
+            and outer[2] >= inner[2] and outer[3] >= inner[3])
+
+
+def iou(a: Box, b: Box) -> float:
+    ix = min(a[2], b[2]) - max(a[0], b[0])
+    iy = min(a[3], b[3]) - max(a[1], b[1])
+    if ix <= 0 or iy <= 0:
+        return 0.0
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class GridIndex:
+    """均匀网格空间索引：每个框登记到它覆盖的所有格子"""
+
+    def __init__(self, cell: int = 256):
+        self.cell = cell
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        self._boxes: Dict[int, Box] = {}
+
+    def _keys(self, box: Box) -> Iterable[Tuple[int, int]]:
+        c = self.cell
+        for gx in range(max(box[0], 0) // c, max(box[2], 0) // c + 1):
+            for gy in range(max(box[1], 0) // c, max(box[3], 0) // c + 1):
+                yield gx, gy
+
+    def insert(self, key: int, box: Box):
+        self._boxes[key] = box
+        for cell in self._keys(box):
+            self._cells.setdefault(cell, []).append(key)
+
+    def remove(self, key: int):
+        box = self._boxes.pop(key, None)
+        if box is None:
+            return
+        for cell in self._keys(box):
+            bucket = self._cells.get(cell)
+            if bucket and key in bucket:
+                bucket.remove(key)
+
+    def query(self, box: Box) -> Set[int]:
+        """返回与 box 所在格子有交集的所有 key（粗筛）"""
+        found: Set[int] = set()
+        for cell in self._keys(box):
+            found.update(self._cells.get(cell, ()))
+        return found
+
+
+class MarkCollapser:
+    """把重叠的候选压缩成最少的可操作目标
+
+    1. 嵌套合并：非可操作节点（文本、图标）并入最近的可操作祖先，文本作为别名保留
+    2. 容器剔除：包含其他候选、自身不可操作且无文本的容器不再标记
+    3. 近似重复：IoU 超过阈值的框只保留一个
+    4. 遮挡剔除：被文档顺序更靠后（绘制在上层）的候选完全覆盖的框丢弃
+    5. 数量上限：按 可操作 > 有文本 的优先级截断
+    """
+
+    def __init__(self, table: ElementTable, iou_threshold: float = 0.9, max_marks: int = 60):
+        self.table = table
+        self.iou_threshold = iou_threshold
+        self.max_marks = max_marks
+
+    def _actionable(self, row: int) -> bool:
+        return bool(self.table.flags[row] & FLAG_ACTIONABLE) or \
+            self.table.class_name[row].endswith('EditText')
+
+    def _labels(self, row: int) -> List[str]:
+        return [v for v in (self.table.text[row], self.table.desc[row]) if v]
+
+    def _is_descendant(self, row: int, ancestor: int) -> bool:
+        parent = self.table.parent
+        node = parent[row]
+        while node != -1:
+            if node == ancestor:
+                return True
+            if node < ancestor:
+                return False
+            node = parent[node]
+        return False
+
+    def collapse(self, rows: List[int]) -> List[Tuple[int, Tuple[str, ...]]]:
+        """返回 [(行号, 合并进来的文本别名)]，保持文档顺序"""
+        table = self.table
+        parent = table.parent
+        candidates = set(rows)
+        aliases: Dict[int, List[str]] = {row: [] for row in rows}
+        merged: Set[int] = set()
+        has_child_candidate: Set[int] = set()
+
+        # 1. 嵌套合并 + 标记容器
+        for row in rows:
+            node = parent[row]
+            target = -1
+            while node != -1:
+                if node in candidates:
+                    has_child_candidate.add(node)
+                    if target == -1 and self._actionable(node):
+                        target = node
+                node = parent[node]
+            if target != -1 and not self._actionable(row):
+                aliases[target].extend(self._labels(row))
+                merged.add(row)
+
+        # 2. 容器剔除
+        kept = [
+            row for row in rows
+            if row not in merged
+            and not (row in has_child_candidate and not self._actionable(row)
+                     and not table.flags[row] & FLAG_HAS_CONTENT)
+        ]
+
+        # 3. 近似重复框合并
+        grid = GridIndex()
+        accepted: List[int] = []
+        for row in kept:
+            box = table.bounds(row)
+            duplicate = -1
+            for other in grid.query(box):
+                if iou(box, table.bounds(other)) >= self.iou_threshold:
+                    duplicate = other
+                    break
+            if duplicate == -1:
+                grid.insert(row, box)
+                accepted.append(row)
+                continue
+            if self._actionable(row) and not self._actionable(duplicate):
+                # 保留可操作的一方
+                aliases[row].extend(self._labels(duplicate) + aliases[duplicate])
+                grid.remove(duplicate)
+                grid.insert(row, box)
+                accepted[accepted.index(duplicate)] = row
+            else:
+                aliases[duplicate].extend(self._labels(row) + aliases[row])
+
+        # 4. 遮挡剔除：后绘制且非自身子孙的候选完全覆盖
+        visible = []
+        for row in accepted:
+            box = table.bounds(row)
+            occluded = any(
+                other > row and contains(table.bounds(other), box)
+                and not self._is_descendant(other, row)
+                for other in grid.query(box)
+            )
+            if not occluded:
+                visible.append(row)
+
+        # 5. 数量上限
+        if self.max_marks and len(visible) > self.max_marks:
+            ranked = sorted(
+                visible,
+                key=lambda r: (not self._actionable(r),
+                               not (table.flags[r] & FLAG_HAS_CONTENT or aliases[r]),
+                               r)
+            )
+            keep = set(ranked[:self.max_marks])
+            visible = [row for row in visible if row in keep]
+
+        return [(row, tuple(dict.fromkeys(aliases[row]))) for row in visible]
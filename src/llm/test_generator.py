@@ -70,7 +70,7 @@ Library    AITestLibrary
     [Teardown]    AI Close App"""
         
         # 调用千问生成
-        test_code = self.qianwen.generate(prompt)
+        test_code = self.qianwen.ask(prompt, lambda r: r if r.strip() else None, site='generate', text=True)
         
         # 清理响应
         test_code = self._clean_code(test_code)
@@ -151,7 +151,7 @@ Library    AITestLibrary
 
 只输出场景列表，不要其他说明。"""
         
-        response = self.qianwen.generate(prompt)
+        response = self.qianwen.ask(prompt, lambda r: r if r.strip() else None, site='generate', text=True)
         
         # 解析响应
         scenarios = []
@@ -1,26 +1,57 @@
 """基于视觉标记 (Set-of-Mark) 的元素定位器"""
-import io
 import re
 import time
-import base64
-import xml.etree.ElementTree as ET
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 from typing import List, Tuple, Dict, Optional
 
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 
 from .qianwen_client import QianwenClient
-from ..core.u2_manager import get_u2
+from .qianwen_transport import QianwenAPIError
+from .resilience import CircuitOpenError
+from .element_index import ElementIndex
+from .element_table import ElementTable, FLAG_CLICKABLE
+from .image_pipeline import ImagePipeline, EncodedImage
+from .spatial_index import MarkCollapser
+from .mark_renderer import MarkRenderer
+from .assertion_evaluator import AssertionEvaluator
+from .query_engine import QueryEngine, ExtractedScreen
+from ..core.u2_manager import get_u2, Snapshot
+from ..core.frame_signature import frame_hash, hamming, hierarchy_digest
+from ..core.artifact_sink import get_artifact_sink
 from ..core.config_manager import get_config
 
 
-@dataclass
+# 方位词 -> 屏幕比例区域 (x1, y1, x2, y2)，多个方位词取交集
+POSITION_REGIONS = (
+    (('顶部', '上方', '上面', '顶端', '左上', '右上'), (0.0, 0.0, 1.0, 0.4)),
+    (('底部', '下方', '下面', '底端', '左下', '右下'), (0.0, 0.6, 1.0, 1.0)),
+    (('左侧', '左边', '左上', '左下'), (0.0, 0.0, 0.55, 1.0)),
+    (('右侧', '右边', '右上', '右下'), (0.45, 0.0, 1.0, 1.0)),
+)
+
+# 依赖外观的描述词：出现时元素表不足以判断，需要看图
+VISUAL_WORDS = ('颜色', '红色', '绿色', '蓝色', '黄色', '黑色', '白色', '灰色', '橙色', '紫色',
+                '图标', '图片', '图像', '头像', '照片', '形状', '圆形', '方形', '箭头', '高亮',
+                '加粗', '样式', 'icon', 'logo', 'color', 'image')
+
+# 提示词形态，按成本从低到高排列，不够用时逐级升级
+PROMPT_MODES = ('text', 'hybrid', 'image')
+
+
+@dataclass(slots=True)
 class VisualElement:
-    """视觉元素数据类"""
+    """视觉元素数据类（只保留定位和取值需要的属性）"""
     id: int
     bounds: Tuple[int, int, int, int]  # x1, y1, x2, y2
     center: Tuple[int, int]
-    elem_node: ET.Element  # 原始 XML 节点
+    row: int = -1  # ElementTable 中的行号
+    text: str = ''
+    desc: str = ''
+    resource_id: str = ''
+    class_name: str = ''
+    flags: int = 0
+    aliases: Tuple[str, ...] = ()  # 合并进来的子节点文本
     
     @property
     def width(self):
@@ -30,6 +61,56 @@ class VisualElement:
     def height(self):
         return self.bounds[3] - self.bounds[1]
 
+    @property
+    def clickable(self) -> bool:
+        return bool(self.flags & FLAG_CLICKABLE)
+
+
+@dataclass
+class Ranking:
+    """一次定位调用返回的排序候选，绑定到对应界面的 UI 结构摘要"""
+    digest: str
+    candidates: List[VisualElement]
+    cursor: int = 0
+    scores: List[Optional[float]] = field(default_factory=list)  # 与 candidates 对应的置信度
+
+    def close_call(self, gap: float) -> bool:
+        """当前候选与下一个候选的置信度差不超过 gap（都给出了置信度才算）"""
+        if self.cursor + 1 >= len(self.scores):
+            return False
+        current, following = self.scores[self.cursor], self.scores[self.cursor + 1]
+        return current is not None and following is not None and current - following <= gap
+
+    @property
+    def current(self) -> Optional[VisualElement]:
+        return self.candidates[self.cursor] if self.cursor < len(self.candidates) else None
+
+
+def interactable_elements(table: ElementTable, screen_w: int, screen_h: int,
+                          max_marks: int = 60) -> List[VisualElement]:
+    """从已解析的元素表提取要标记的元素，编号从 1 开始"""
+    # 核心逻辑：只标记真正可交互的元素，或者有明确文本内容的元素；
+    # 嵌套/重叠/被遮挡的候选合并为最少的可操作目标
+    rows = table.candidate_rows(screen_w, screen_h)
+    collapsed = MarkCollapser(table, max_marks=max_marks).collapse(rows)
+
+    elements = []
+    for count, (row, aliases) in enumerate(collapsed, start=1):
+        bounds = table.bounds(row)
+        elements.append(VisualElement(
+            id=count,
+            bounds=bounds,
+            center=((bounds[0] + bounds[2]) // 2, (bounds[1] + bounds[3]) // 2),
+            row=row,
+            text=table.text[row],
+            desc=table.desc[row],
+            resource_id=table.resource_id[row],
+            class_name=table.class_name[row],
+            flags=table.flags[row],
+            aliases=aliases,
+        ))
+    return elements
+
 
 class VisualLocator:
     """基于 Set-of-Mark 的视觉定位器
@@ -46,232 +127,735 @@ class VisualLocator:
         self.u2 = get_u2()
         self.config = get_config()
         self.retry_count = self.config.get('ai.locator.retry_count', 3)
-
-    def _parse_bounds(self, bounds_str: str) -> Tuple[int, int, int, int]:
-        """解析 bounds 字符串 [x1,y1][x2,y2]"""
-        match = re.findall(r'\[(\d+),(\d+)\]', bounds_str)
-        if len(match) == 2:
-            x1, y1 = int(match[0][0]), int(match[0][1])
-            x2, y2 = int(match[1][0]), int(match[1][1])
-            return (x1, y1, x2, y2)
-        return (0, 0, 0, 0)
+        self.max_marks = self.config.get('ai.locator.max_marks', 60)
+        self.two_stage = self.config.get('ai.locator.two_stage', False)
+        self.two_stage_min_elements = self.config.get('ai.locator.two_stage_min_elements', 30)
+        self.coarse_side = self.config.get('ai.locator.coarse_side', 512)
+        self.top_k = self.config.get('ai.locator.top_k', 3)
+        self.verify_tap = self.config.get('ai.locator.verify_tap', False)
+        self.tap_gap = self.config.get('ai.locator.tap_gap', 0.2)
+        self._rankings: Dict[str, Ranking] = {}
+        self.fast_path = self.config.get('ai.locator.fast_path', True)
+        self.fast_path_threshold = self.config.get('ai.locator.fast_path_threshold', 0.85)
+        self.opaque_coverage = self.config.get('ai.locator.opaque_coverage', 0.5)
+        self.prompt_mode = self.config.get('ai.locator.prompt_mode', 'auto')
+        self.text_coverage = self.config.get('ai.locator.text_coverage', 0.8)
+        self.hybrid_coverage = self.config.get('ai.locator.hybrid_coverage', 0.5)
+        self.hybrid_side = self.config.get('ai.locator.hybrid_side', 512)
+        self.escalate_confidence = self.config.get('ai.locator.escalate_confidence', 0.5)
+        self.grid_cells = self.config.get('ai.visual.grid_cells', 4)
+        self.grid_depth = self.config.get('ai.visual.grid_depth', 2)
+        self.grid_refine = self.config.get('ai.visual.grid_refine', 3)
+        self.wait_signature = self.config.get('ai.wait.signature', 'frame')
+        self.wait_change_threshold = self.config.get('ai.wait.change_threshold', 4)
+        self.wait_poll_min = self.config.get('ai.wait.poll_min', 0.2)
+        self.wait_poll_max = self.config.get('ai.wait.poll_max', 2.0)
+        self.wait_model_interval = self.config.get('ai.wait.model_interval', 1.0)
+        self.assert_hierarchy_first = self.config.get('ai.assert.hierarchy_first', True)
+        self.evaluator = AssertionEvaluator(self.qianwen)
+        self.query_hierarchy_first = self.config.get('ai.query.hierarchy_first', True)
+        self.query_engine = QueryEngine()
+        self.artifacts = get_artifact_sink()
+        self.pipeline = ImagePipeline()
+        self.renderer = MarkRenderer()
+        self._index_cache: Tuple[int, Optional[ElementIndex]] = (0, None)
 
     def _get_interactable_elements(self, xml_str: str, screen_w: int, screen_h: int) -> List[VisualElement]:
         """从 XML 解析所有可交互元素"""
-        elements = []
-        try:
-            root = ET.fromstring(xml_str)
-        except ET.ParseError:
-            print("XML 解析失败，将使用纯视觉模式（暂不支持纯视觉无标记）")
-            return elements
+        table = ElementTable.from_xml(xml_str)
+        if table.parse_error:
+            print("XML 解析失败，将使用纯视觉模式")
+            return []
+        return interactable_elements(table, screen_w, screen_h, self.max_marks)
 
-        # 计数器
-        count = 1
-        
-        for node in root.iter():
-            # 基本属性过滤
-            bounds_str = node.get('bounds', '')
-            if not bounds_str: continue
-            
-            clickable = node.get('clickable', 'false') == 'true'
-            long_clickable = node.get('long-clickable', 'false') == 'true'
-            checkable = node.get('checkable', 'false') == 'true'
-            focusable = node.get('focusable', 'false') == 'true'
-            
-            # 文本属性（辅助判断）
-            text = node.get('text', '')
-            desc = node.get('content-desc', '')
-            
-            # 核心逻辑：只标记真正可交互的元素，或者有明确文本内容的元素
-            is_interactable = clickable or long_clickable or checkable or focusable
-            has_content = bool(text or desc)
-            
-            # 过滤条件
-            if is_interactable or has_content:
-                bounds = self._parse_bounds(bounds_str)
-                w = bounds[2] - bounds[0]
-                h = bounds[3] - bounds[1]
-                
-                # 1. 过滤全屏容器 (通常是背景)
-                if w >= screen_w * 0.95 and h >= screen_h * 0.95:
-                    continue
-                    
-                # 2. 过滤微小元素 (通常是装饰点)
-                if w < 20 or h < 20:
-                    continue
-                
-                # 3. 过滤屏幕外的元素
-                if bounds[2] < 0 or bounds[3] < 0 or bounds[0] > screen_w or bounds[1] > screen_h:
-                    continue
-
-                cx = (bounds[0] + bounds[2]) // 2
-                cy = (bounds[1] + bounds[3]) // 2
-                
-                elements.append(VisualElement(
-                    id=count,
-                    bounds=bounds,
-                    center=(cx, cy),
-                    elem_node=node
-                ))
-                count += 1
-                
-        return elements
-
-    def _draw_marks(self, image_bytes: bytes, elements: List[VisualElement]) -> Tuple[str, Image.Image]:
-        """在截图上绘制标记，返回 base64 和图片对象"""
-        img = Image.open(io.BytesIO(image_bytes))
-        draw = ImageDraw.Draw(img)
+    def refresh_element(self, elem: VisualElement) -> Optional[VisualElement]:
+        """核对预先定位的元素是否仍在当前界面上
         
-        # 尝试加载字体，失败则使用默认
+        同一位置还有同类节点时原样返回；位置变了（如键盘弹出后布局上移）但 resource-id
+        能唯一识别时返回更新坐标后的元素；都不满足返回 None，由调用方重新定位。
+        """
+        xml_str = self.u2.get_page_source()
+        if not xml_str:
+            return None
+        table = ElementTable.from_xml(xml_str)
+        if table.parse_error:
+            return None
+        moved = []
+        for row in range(len(table)):
+            if table.class_name[row] != elem.class_name:
+                continue
+            if table.bounds(row) == elem.bounds:
+                return elem
+            if elem.resource_id and table.resource_id[row] == elem.resource_id:
+                moved.append(row)
+        if len(moved) != 1:
+            return None
+        bounds = table.bounds(moved[0])
+        if bounds[2] <= bounds[0] or bounds[3] <= bounds[1]:
+            return None
+        return replace(elem, bounds=bounds, row=moved[0],
+                       center=((bounds[0] + bounds[2]) // 2, (bounds[1] + bounds[3]) // 2))
+
+    def _draw_marks(self, img: Image.Image, elements: List[VisualElement], scale: float = 1.0,
+                    offset: Tuple[int, int] = (0, 0)) -> Image.Image:
+        """在（已缩放/裁剪的）截图上绘制标记，元素坐标先减去 offset 再按 scale 换算"""
+        return self.renderer.render(img, elements, scale, offset)
+
+    def _save_debug_image(self, tag: str, image: EncodedImage):
+        """提交调试图片到异步写入器（直接使用编码结果，不阻塞当前关键字）"""
+        path = self.artifacts.submit(tag, image.data, image.ext)
+        if path:
+            print(f"[VisualLocator] Debug image queued: {path}")
+
+    def _capture_image(self) -> Optional[EncodedImage]:
+        """截图并按配置缩放编码"""
+        img = self.u2.get_screenshot_image()
+        if img is None:
+            return None
+        return self.pipeline.prepare(img)
+
+    def _get_index(self, xml_str: str, elements: List[VisualElement]) -> ElementIndex:
+        """获取当前界面的元素索引（同一份 XML 只建一次）"""
+        key = hash(xml_str)
+        cached_key, index = self._index_cache
+        if index is None or cached_key != key:
+            index = ElementIndex(elements)
+            self._index_cache = (key, index)
+        return index
+
+    def _load_screen(self, snapshot: Optional[Snapshot] = None) -> Tuple[Snapshot, List[VisualElement], bool]:
+        """并发采集截图和 XML（或使用已采集的快照），并提取元素
+
+        Returns:
+            (快照, 元素列表, 是否改用纯视觉网格定位)
+        """
+        snapshot = snapshot or self.u2.capture_snapshot()
+        if snapshot is None:
+            raise Exception("无法获取设备截图或 UI 结构")
+        if not snapshot.consistent:
+            print("[VisualLocator] Warning: 截图与 UI 结构不一致，标记位置可能偏移")
+
+        table = ElementTable.from_xml(snapshot.xml)
+        if table.parse_error:
+            print("XML 解析失败，将使用纯视觉模式")
+            return snapshot, [], True
+        elements = interactable_elements(table, snapshot.width, snapshot.height, self.max_marks)
+        # 元素少不代表 UI 结构不可用（如只有两个按钮的对话框）；没有候选，或大片屏幕是
+        # UI 结构看不到内容的自绘区域（游戏、Canvas、Flutter、WebView 等）时才改用纯视觉网格定位
+        opaque = table.opaque_ratio(snapshot.width, snapshot.height)
+        visual = not elements or opaque >= self.opaque_coverage
+        if visual:
+            print(f"[VisualLocator] Hierarchy covers little of the screen ({len(elements)} elements, "
+                  f"{opaque:.0%} opaque), using pure visual mode")
+        return snapshot, elements, visual
+
+    def _mark_screenshot(self, elements: List[VisualElement], screenshot: Image.Image,
+                         region: Tuple[int, int, int, int] = None) -> EncodedImage:
+        """截图（可裁剪到 region）缩放后绘制标记，只编码一次"""
+        offset = (0, 0)
+        crop = screenshot
+        if region:
+            crop = screenshot.crop(region)
+            offset = (region[0], region[1])
+
+        small, scale = self.pipeline.downscale(crop)
+        # 无需缩放时 downscale 返回原图，标记不能画在快照复用的截图上
+        small = small.copy() if small is screenshot else small
+        marked = self.pipeline.encode(self._draw_marks(small, elements, scale, offset), scale, offset)
+        self._save_debug_image("marked", marked)
+        return marked
+
+    def _infer_region(self, description: str, width: int, height: int) -> Optional[Tuple[int, int, int, int]]:
+        """根据描述中的方位词推断粗略区域"""
+        x1, y1, x2, y2 = 0.0, 0.0, 1.0, 1.0
+        matched = False
+        for words, (fx1, fy1, fx2, fy2) in POSITION_REGIONS:
+            if any(word in description for word in words):
+                x1, y1 = max(x1, fx1), max(y1, fy1)
+                x2, y2 = min(x2, fx2), min(y2, fy2)
+                matched = True
+        if not matched or x1 >= x2 or y1 >= y2:
+            return None
+        return (int(x1 * width), int(y1 * height), int(x2 * width), int(y2 * height))
+
+    def _ask_region(self, description: str, screenshot: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+        """第一阶段：在缩小的 3x3 网格图上让模型选择目标所在区域"""
+        small, scale = self.pipeline.downscale(screenshot, self.coarse_side)
+        small = small.copy() if small is screenshot else small
+        draw = ImageDraw.Draw(small)
+        font = self.renderer.font(16)
+        w, h = small.size
+        for i in range(1, 3):
+            draw.line((w * i // 3, 0, w * i // 3, h), fill='red', width=2)
+            draw.line((0, h * i // 3, w, h * i // 3), fill='red', width=2)
+        for cell in range(9):
+            cx, cy = cell % 3, cell // 3
+            draw.text((w * cx // 3 + 4, h * cy // 3 + 4), str(cell + 1), fill='red', font=font)
+        coarse = self.pipeline.encode(small, scale)
+
+        prompt = f"""
+任务：截图被红线分成 3x3 共 9 个区域，按从左到右、从上到下编号 1-9。
+请判断"{description}"位于哪个区域，只返回区域编号（1-9）；无法判断返回 0。
+"""
         try:
-            # Windows 常用字体
-            font = ImageFont.truetype("arial.ttf", 30)
-        except:
-            font = ImageFont.load_default()
+            response = self.qianwen.generate(prompt, image=coarse, site='locate',
+                                             accept=lambda r: self._parse_region_cell(r) or None)
+        except Exception as e:
+            print(f"[VisualLocator] Coarse stage failed: {e}")
+            return None
+        cell = self._parse_region_cell(response)
+        if not cell:
+            return None
 
-        for elem in elements:
-            # 绘制边界框
-            # 颜色轮换，方便区分
-            colors = ['red', 'blue', 'green', 'orange', 'purple']
-            color = colors[elem.id % len(colors)]
-            
-            draw.rectangle(elem.bounds, outline=color, width=3)
-            
-            # 绘制编号背景和文字
-            label = str(elem.id)
-            # 标签位置：左上角
-            x, y = elem.bounds[0], elem.bounds[1]
-            # 确保标签在屏幕内
-            if y < 30: y = 30
-            
-            # 绘制标签背景
-            # 计算文本大小
-            left, top, right, bottom = draw.textbbox((x, y), label, font=font)
-            w, h = right - left, bottom - top
-            draw.rectangle((x, y - h - 5, x + w + 10, y + 5), fill=color)
-            
-            # 绘制文字
-            draw.text((x + 5, y - h - 5), label, fill='white', font=font)
-            
-        # 保存到 buffer
-        buf = io.BytesIO()
-        img.save(buf, format='PNG')
-        base64_str = base64.b64encode(buf.getvalue()).decode('utf-8')
-        
-        return base64_str, img
+        # 选中格子向四周各扩展半格，避免目标压线
+        sw, sh = screenshot.size
+        cw, ch = sw / 3, sh / 3
+        cx, cy = (cell - 1) % 3, (cell - 1) // 3
+        return (max(0, int((cx - 0.5) * cw)), max(0, int((cy - 0.5) * ch)),
+                min(sw, int((cx + 1.5) * cw)), min(sh, int((cy + 1.5) * ch)))
 
-    def find_element(self, description: str) -> VisualElement:
-        """通过视觉定位元素"""
-        print(f"[VisualLocator] Finding: {description}")
+    @staticmethod
+    def _parse_region_cell(response: str) -> int:
+        """粗定位回答中的区域编号（1-9），无效或无法判断时为 0"""
+        match = re.search(r'\d', response)
+        cell = int(match.group()) if match else 0
+        return cell if 1 <= cell <= 9 else 0
+
+    def _coarse_region(self, description: str, elements: List[VisualElement],
+                       screenshot: Image.Image) -> Tuple[Optional[Tuple[int, int, int, int]], List[VisualElement]]:
+        """两阶段定位的第一阶段，返回 (裁剪区域, 区域内元素)；不适用时区域为 None"""
+        if not self.two_stage or len(elements) < self.two_stage_min_elements:
+            return None, elements
+
+        region = self._infer_region(description, *screenshot.size) or self._ask_region(description, screenshot)
+        if not region:
+            return None, elements
+
+        inside = [e for e in elements
+                  if region[0] <= e.center[0] <= region[2] and region[1] <= e.center[1] <= region[3]]
+        if not inside:
+            return None, elements
+        print(f"[VisualLocator] Two-stage region: {region}, {len(inside)}/{len(elements)} elements")
+        return region, inside
+
+    def _grid_shape(self, width: int, height: int, cells: int) -> Tuple[int, int]:
+        """短边分 cells 格，长边按宽高比取格数，让格子接近正方形"""
+        if width <= height:
+            return max(1, round(cells * height / width)), cells
+        return cells, max(1, round(cells * width / height))
+
+    def _ask_grid(self, description: str, grid: EncodedImage, rows: int, cols: int) -> Optional[dict]:
+        """让模型在网格图上选择格子或直接给出坐标
+
+        Returns:
+            {'cell': 编号} 或 {'point': (x, y)}（图片坐标），可带 'text'；找不到返回 None
+        """
+        w, h = grid.size
+        prompt = f"""
+任务：你是一个 UI 自动化测试助手。截图（{w}x{h} 像素）被红线分成 {rows} 行 {cols} 列共 {rows * cols} 个格子，
+按从左到右、从上到下编号 1-{rows * cols}，编号标在格子左上角。
+
+用户描述："{description}"
+
+请找到该元素，只返回 JSON，不要解释：
+- 能准确判断元素中心时返回像素坐标：{{"point": [x, y], "text": "元素上的文字"}}
+- 否则返回元素中心所在的格子：{{"cell": 5, "text": "元素上的文字"}}
+- 没有文字时 text 为空字符串；找不到返回 {{"cell": -1}}
+"""
+        tiers = self.qianwen.router.tiers('locate')
+        for attempt in range(self.retry_count):
+            try:
+                # 无效回答时下一次换更强的模型
+                tier = tiers[min(attempt, len(tiers) - 1)]
+                response = self.qianwen.generate(
+                    prompt, image=grid, site='locate', tier=tier, use_cache=attempt == 0,
+                    accept=lambda r: self._parse_grid_answer(r, w, h, rows, cols))
+                print(f"[VisualLocator] AI Response: {response}")
+                return self._parse_grid_answer(response, w, h, rows, cols)
+            except Exception as e:
+                print(f"[VisualLocator] Grid attempt {attempt+1} failed: {e}")
+        return None
+
+    def _parse_grid_answer(self, response: str, w: int, h: int, rows: int, cols: int) -> Optional[dict]:
+        """解析网格回答
+
+        Returns:
+            {'cell': 编号} 或 {'point': (x, y)}，可带 'text'；明确找不到时返回 None
+
+        Raises:
+            ValueError: 回答无法解析或格子/坐标无效
+        """
+        answer = self.qianwen.parse_json_response(response)
+        if not isinstance(answer, dict):
+            answer = {'cell': answer}
+
+        text = str(answer.get('text') or '')
+        point = answer.get('point')
+        if isinstance(point, (list, tuple)) and len(point) == 2:
+            try:
+                x, y = float(point[0]), float(point[1])
+            except (TypeError, ValueError):
+                x, y = -1.0, -1.0
+            if 0 <= x <= w and 0 <= y <= h:
+                return {'point': (x, y), 'text': text}
+        try:
+            cell = int(answer.get('cell', -1))
+        except (TypeError, ValueError):
+            cell = 0
+        if cell == -1:
+            return None
+        if 1 <= cell <= rows * cols:
+            return {'cell': cell, 'text': text}
+        raise ValueError(f"AI 返回了无效的格子: {answer}")
+
+    def _find_by_grid(self, description: str, screenshot: Image.Image) -> VisualElement:
+        """纯视觉定位：编号网格 + 逐级放大
+
+        第一级按屏幕宽高比铺网格，选中格子后裁出该格（四周留半格余量）
+        再铺更细的网格，最多 ai.visual.grid_depth 级；模型直接给出坐标时立即返回。
+        坐标统一经 EncodedImage.to_device 映射回设备坐标。
+        """
+        sw, sh = screenshot.size
+        region = (0, 0, sw, sh)
+        box, text = None, ''
+
+        for level in range(self.grid_depth):
+            crop = screenshot.crop(region) if region != (0, 0, sw, sh) else screenshot
+            small, scale = self.pipeline.downscale(crop)
+            small = small.copy() if small is crop else small
+            if level == 0:
+                rows, cols = self._grid_shape(*small.size, self.grid_cells)
+            else:
+                rows = cols = self.grid_refine
+            grid = self.pipeline.encode(self.renderer.render_grid(small, rows, cols), scale, region[:2])
+            self._save_debug_image("grid", grid)
+
+            answer = self._ask_grid(description, grid, rows, cols)
+            if answer is None:
+                if box is None:
+                    raise Exception(f"AI 未找到元素: {description}")
+                break  # 细分后没找到，用上一级的格子
+            text = answer['text'] or text
+
+            if 'point' in answer:
+                x, y = grid.to_device(*answer['point'])
+                print(f"[VisualLocator] Grid point @ ({x}, {y}), level {level + 1}")
+                half = max(8, min(sw, sh) // 40)
+                return VisualElement(id=0, bounds=(max(0, x - half), max(0, y - half),
+                                                   min(sw, x + half), min(sh, y + half)),
+                                     center=(x, y), text=text)
+
+            # 格子（图片坐标）-> 设备坐标
+            cell = answer['cell'] - 1
+            gw, gh = grid.size
+            r, c = divmod(cell, cols)
+            box = grid.to_device_box((gw * c / cols, gh * r / rows, gw * (c + 1) / cols, gh * (r + 1) / rows))
+            print(f"[VisualLocator] Grid cell {cell + 1}/{rows * cols} -> {box}, level {level + 1}")
+
+            half_w, half_h = (box[2] - box[0]) // 2, (box[3] - box[1]) // 2
+            region = (max(0, box[0] - half_w), max(0, box[1] - half_h),
+                      min(sw, box[2] + half_w), min(sh, box[3] + half_h))
+
+        return VisualElement(id=0, bounds=box,
+                             center=((box[0] + box[2]) // 2, (box[1] + box[3]) // 2), text=text)
+
+    def find_element(self, description: str, snapshot: Optional[Snapshot] = None) -> VisualElement:
+        """通过视觉定位元素
         
-        # 1. 获取截图和 XML
-        screenshot = self.u2.get_screenshot_bytes()
-        xml_str = self.u2.get_page_source()
-        window_size = self.u2.get_window_size()
+        Args:
+            snapshot: 已采集的快照（预取时使用），不传则重新采集
+        """
+        print(f"[VisualLocator] Finding: {description}")
         
-        if not screenshot or not xml_str:
-            raise Exception("无法获取设备截图或 UI 结构")
+        # 1. 获取截图、XML 并提取元素
+        snapshot, elements, visual = self._load_screen(snapshot)
+
+        # 2. 本地快速通道：描述唯一命中元素文本/描述/资源 ID 时不调用大模型
+        if self.fast_path:
+            elem = self._get_index(snapshot.xml, elements).resolve(description, self.fast_path_threshold)
+            if elem:
+                print(f"[VisualLocator] Fast path hit: ID:{elem.id}")
+                return elem
+
+        # UI 结构不可用时走纯视觉网格定位
+        if visual:
+            return self._find_by_grid(description, snapshot.image)
+
+        # 3. 同一界面已有排序候选时直接复用
+        digest = hierarchy_digest(snapshot.xml)
+        ranking = self._rankings.get(description)
+        if ranking and ranking.digest == digest and ranking.current:
+            print(f"[VisualLocator] Reusing ranked candidate #{ranking.cursor + 1}: ID:{ranking.current.id}")
+            return ranking.current
+
+        # 4. 两阶段模式下只考虑粗定位区域内的元素
+        screenshot = snapshot.image
+        region, candidates = self._coarse_region(description, elements, screenshot)
+
+        # 5. 按界面选择提示词形态：元素表 / 小图 + 元素表 / 标记截图，不够用时逐级升级；
+        #    标记截图仍不可用时再升级模型档位
+        router = self.qianwen.router
+        mode = self._select_mode(description, candidates)
+        tier = router.tiers('locate')[0]
+        attempt = 0
+        while attempt < self.retry_count:
+            started = time.time()
+            try:
+                # 重试同一提示词时不读缓存；只有可用的排序结果写入缓存
+                pool = candidates
+                response = self._ask_candidates(description, mode, candidates, screenshot, region, tier,
+                                                accept=lambda r: self._usable_candidates(r, pool),
+                                                use_cache=attempt == 0)
+                print(f"[VisualLocator] AI Response ({mode}/{tier}): {response}")
+                ranked, scores = self._parse_candidates(response, candidates)
+            except (QianwenAPIError, CircuitOpenError):
+                # 传输层已经按退避策略重试过，这里不再重复
+                raise
+            except Exception as e:
+                print(f"[VisualLocator] Attempt {attempt+1} failed: {e}")
+                attempt += 1
+                mode = self._escalate(mode)
+                continue
+
+            confidence = scores[0] if scores else None
+            confident = confidence is None or confidence >= self.escalate_confidence
+            next_tier = router.next_tier('locate', tier)
+            accepted = bool(ranked) and (confident or (mode == 'image' and next_tier is None))
+            router.record('locate', tier, accepted, time.time() - started)
+            if accepted:
+                self._remember_ranking(description, digest, ranked, scores)
+                return ranked[0]
+
+            if mode != 'image':
+                mode = self._escalate(mode)
+                print(f"[VisualLocator] Escalating to {mode} prompt")
+                continue
+            if next_tier:
+                tier = next_tier
+                print(f"[VisualLocator] Escalating to {tier} model")
+                continue
 
-        # 2. 提取元素
-        elements = self._get_interactable_elements(xml_str, window_size['width'], window_size['height'])
+            attempt += 1
+            if region:
+                # 区域内没找到，退回全屏标记
+                print("[VisualLocator] Not found in region, falling back to full screen")
+                region, candidates = None, elements
+                continue
+            # 标记截图 + 最强模型明确没找到，不再当作失败重试
+            raise Exception(f"AI 未找到元素: {description}")
         
+        raise Exception(f"无法定位元素: {description}")
+
+    @staticmethod
+    def _serialize_elements(elements: List[VisualElement]) -> str:
+        """元素表序列化为紧凑文本：id|class|text|desc|bounds"""
+        lines = ["id|class|text|desc|bounds"]
+        for elem in elements:
+            text = elem.text or "/".join(elem.aliases)
+            cells = (text[:40], elem.desc[:40])
+            text, desc = (c.replace('|', '/').replace('\n', ' ') for c in cells)
+            lines.append(f"{elem.id}|{elem.class_name.rsplit('.', 1)[-1]}|{text}|{desc}|"
+                         f"{','.join(str(v) for v in elem.bounds)}")
+        return "\n".join(lines)
+
+    def _select_mode(self, description: str, elements: List[VisualElement]) -> str:
+        """按文本覆盖率和描述是否依赖外观，决定本次用哪种提示词
+
+        - text: 大部分候选都有文字，且描述不涉及颜色/图标等外观，只发元素表给纯文本模型
+        - hybrid: 文字覆盖一般，发缩小的原图 + 元素表
+        - image: 发完整的标记截图
+        """
+        if self.prompt_mode in PROMPT_MODES:
+            return self.prompt_mode
         if not elements:
-            raise Exception("当前界面未检测到可交互元素")
-            
-        # 3. 绘制标记
-        marked_base64, marked_img = self._draw_marks(screenshot, elements)
-        
-        # 保存调试图片
-        marked_img.save("last_marked_screenshot.png")
-        print("[VisualLocator] Debug image saved to last_marked_screenshot.png")
+            return 'image'
+        lowered = description.lower()
+        if any(word in lowered for word in VISUAL_WORDS):
+            return 'image'
 
-        # 4. 构造 Prompt
-        prompt = f"""
-任务：你是一个 UI 自动化测试助手。我会在截图上给所有可交互元素打上数字标签。
-请根据我的描述，找到对应的元素，并返回它的数字编号。
+        covered = sum(1 for e in elements if e.text or e.desc or e.aliases)
+        coverage = covered / len(elements)
+        if coverage >= self.text_coverage:
+            return 'text'
+        if coverage >= self.hybrid_coverage:
+            return 'hybrid'
+        return 'image'
 
-用户描述："{description}"
+    @staticmethod
+    def _escalate(mode: str) -> str:
+        return PROMPT_MODES[min(PROMPT_MODES.index(mode) + 1, len(PROMPT_MODES) - 1)]
 
+    def _ask_candidates(self, description: str, mode: str, candidates: List[VisualElement],
+                        screenshot: Image.Image, region: Optional[Tuple[int, int, int, int]],
+                        tier: str = None, accept=None, use_cache: bool = True) -> str:
+        """按提示词形态和模型档位构造 Prompt 并调用对应模型（accept / use_cache 见 QianwenClient.generate）"""
+        answer_format = f"""
 要求：
-1. 仔细观察截图中的视觉特征（颜色、形状、图标、文字）。
+1. 按可能性从高到低返回最多 {self.top_k} 个候选编号。
 2. 结合上下文判断（例如"右侧的按钮"、"底部的输入框"）。
-3. 只返回一个数字编号，不要解释。如果不确定或找不到，返回 -1。
+3. 只返回 JSON，不要解释。confidence 为 0-1 的置信度；找不到返回空列表。
 
 格式示例：
 User: 点击搜索框
-Assistant: 5
+Assistant: {{"candidates": [{{"id": 5, "confidence": 0.9}}, {{"id": 12, "confidence": 0.3}}]}}
 """
+        if mode == 'image':
+            marked = self._mark_screenshot(candidates, screenshot, region)
+            prompt = f"""
+任务：你是一个 UI 自动化测试助手。我会在截图上给所有可交互元素打上数字标签。
+请根据我的描述，找到对应的元素。
+
+用户描述："{description}"
+
+仔细观察截图中的视觉特征（颜色、形状、图标、文字）。
+{answer_format}"""
+            return self.qianwen.generate(prompt, image=marked, site='locate', tier=tier,
+                                         accept=accept, use_cache=use_cache)
+
+        w, h = screenshot.size
+        prompt = f"""
+任务：你是一个 UI 自动化测试助手。下面是当前界面的元素表（屏幕 {w}x{h}，bounds 为 x1,y1,x2,y2 像素坐标）。
+请根据我的描述，从表中找到对应的元素。
+
+元素表：
+{self._serialize_elements(candidates)}
+
+用户描述："{description}"
+{answer_format}"""
+        if mode == 'text':
+            return self.qianwen.generate_text(prompt, site='locate', tier=tier,
+                                              accept=accept, use_cache=use_cache)
+
+        crop = screenshot.crop(region) if region else screenshot
+        small, scale = self.pipeline.downscale(crop, self.hybrid_side)
+        preview = self.pipeline.encode(small, scale, region[:2] if region else (0, 0))
+        return self.qianwen.generate(prompt + "\n附图为界面缩略图，仅用于参考外观。", image=preview,
+                                     site='locate', tier=tier, accept=accept, use_cache=use_cache)
+
+    def _usable_candidates(self, response: str, pool: List[VisualElement]) -> Optional[List[VisualElement]]:
+        """有有效候选且置信度足够时返回候选（决定回答能否写入缓存）"""
+        ranked, scores = self._parse_candidates(response, pool)
+        confidence = scores[0] if scores else None
+        if ranked and (confidence is None or confidence >= self.escalate_confidence):
+            return ranked
+        return None
+
+    def _parse_candidates(self, response: str,
+                          pool: List[VisualElement]) -> Tuple[List[VisualElement], List[Optional[float]]]:
+        """解析排序候选，丢弃无效编号；兼容只返回一个数字的旧格式
+
+        Returns:
+            (候选列表, 对应的置信度列表)；模型没有给出置信度的候选为 None
+        """
+        by_id = {elem.id: elem for elem in pool}
+        try:
+            scored = self.qianwen.parse_json_response(response, schema='locate')
+        except ValueError:
+            scored = [(int(m), None) for m in re.findall(r'-?\d+', response)]
         
-        # 5. 调用大模型
-        for attempt in range(self.retry_count):
-            try:
-                # 构造多模态消息
-                messages = [
-                    {
-                        "role": "user",
-                        "content": [
-                            {"image": f"data:image/png;base64,{marked_base64}"},
-                            {"text": prompt}
-                        ]
-                    }
-                ]
-                
-                # 调用 Qwen-VL
-                # 注意：这里我们需要复用 QianwenClient，但它目前的 generate 方法可能只支持纯文本或单图
-                # 我们需要稍微 hack 一下或者确保 QianwenClient 支持这种格式
-                # 假设 QianwenClient.generate 已经支持处理 base64 图片（之前实现是支持的）
-                
-                # 为了稳妥，我们这里直接调用 generate，但在 QianwenClient 中可能需要适配
-                # 之前的 QianwenClient 实现是支持 prompt 中包含 image 的
-                
-                # 简单起见，我们传递带 image 标记的 prompt 给 QianwenClient
-                # 假设 QianwenClient 内部会处理 DashScope 的多模态格式
-                
-                response = self.qianwen.generate(prompt, image_path="last_marked_screenshot.png")
-                print(f"[VisualLocator] AI Response: {response}")
-                
-                # 解析结果
-                match = re.search(r'(\d+)', response)
-                if match:
-                    elem_id = int(match.group(1))
-                    if elem_id == -1:
-                        raise Exception(f"AI 未找到元素: {description}")
-                    
-                    # 查找对应 ID 的元素
-                    for elem in elements:
-                        if elem.id == elem_id:
-                            return elem
-                    
+        ranked, scores = [], []
+        for elem_id, conf in scored:
+            elem = by_id.get(elem_id)
+            if elem is None:
+                if elem_id != -1:
                     print(f"[VisualLocator] AI 返回了无效的 ID: {elem_id}")
-                
+                continue
+            if elem not in ranked:
+                ranked.append(elem)
+                scores.append(conf)
+        return ranked[:self.top_k], scores[:self.top_k]
+
+    def _remember_ranking(self, description: str, digest: str, ranked: List[VisualElement],
+                          scores: List[Optional[float]]):
+        """保存排序候选，界面变化后的旧记录一并清理"""
+        self._rankings = {desc: r for desc, r in self._rankings.items() if r.digest == digest}
+        self._rankings[description] = Ranking(digest, ranked, scores=scores)
+
+    def adopt_rankings(self, other: 'VisualLocator', elements):
+        """接收另一个定位器（如预取用的定位器）为这些元素记录的排序候选"""
+        elements = list(elements)
+        for description, ranking in list(other._rankings.items()):
+            if any(ranking.current is elem for elem in elements):
+                self._rankings[description] = ranking
+
+    def find_elements(self, descriptions: List[str],
+                      snapshot: Optional[Snapshot] = None) -> Dict[str, VisualElement]:
+        """批量定位：同一屏幕只截图、标记一次，一次模型调用解析所有描述
+        
+        Args:
+            snapshot: 已采集的快照（预取时使用），不传则重新采集
+        
+        Returns:
+            dict: {描述: 元素}，调用方可据此依次操作
+        """
+        print(f"[VisualLocator] Finding many: {descriptions}")
+        descriptions = list(dict.fromkeys(descriptions))
+        snapshot, elements, visual = self._load_screen(snapshot)
+        by_id = {elem.id: elem for elem in elements}
+        
+        result: Dict[str, VisualElement] = {}
+        if self.fast_path:
+            index = self._get_index(snapshot.xml, elements)
+            for desc in descriptions:
+                elem = index.resolve(desc, self.fast_path_threshold)
+                if elem:
+                    print(f"[VisualLocator] Fast path hit: {desc} -> ID:{elem.id}")
+                    result[desc] = elem
+        
+        pending = [desc for desc in descriptions if desc not in result]
+        if not pending:
+            return result
+        if visual:
+            for desc in pending:
+                result[desc] = self._find_by_grid(desc, snapshot.image)
+            return result
+        
+        router = self.qianwen.router
+        mode = self._select_mode(" ".join(pending), elements)
+        tier = router.tiers('locate')[0]
+        marked = preview = None
+        attempt = 0
+        while attempt < self.retry_count:
+            listing = "\n".join(f"{i}. {desc}" for i, desc in enumerate(pending, start=1))
+            answer_format = """
+要求：
+1. 结合上下文判断方位（例如"右侧的按钮"、"底部的输入框"）。
+2. 只返回 JSON 对象，键为描述序号，值为元素编号；找不到的填 -1，不要解释。
+
+格式示例：
+{"1": 5, "2": 12}
+"""
+            if mode == 'image':
+                prompt = f"""
+任务：你是一个 UI 自动化测试助手。我会在截图上给所有可交互元素打上数字标签。
+请根据下面每一条描述，分别找到对应的元素编号，仔细观察截图中的视觉特征（颜色、形状、图标、文字）。
+
+描述列表：
+{listing}
+{answer_format}"""
+            else:
+                w, h = snapshot.image.size
+                prompt = f"""
+任务：你是一个 UI 自动化测试助手。下面是当前界面的元素表（屏幕 {w}x{h}，bounds 为 x1,y1,x2,y2 像素坐标）。
+请根据下面每一条描述，分别从表中找到对应的元素编号。
+
+元素表：
+{self._serialize_elements(elements)}
+
+描述列表：
+{listing}
+{answer_format}"""
+            # 只有全部描述都找到的回答写入缓存；重试同一提示词时不读缓存
+            asked = list(pending)
+            options = dict(site='locate', tier=tier, use_cache=attempt == 0,
+                           accept=lambda r: self._complete_batch(r, asked, by_id))
+            try:
+                if mode == 'image':
+                    marked = marked or self._mark_screenshot(elements, snapshot.image)
+                    response = self.qianwen.generate(prompt, image=marked, **options)
+                elif mode == 'hybrid':
+                    if preview is None:
+                        preview = self.pipeline.encode(*self.pipeline.downscale(snapshot.image, self.hybrid_side))
+                    response = self.qianwen.generate(prompt + "\n附图为界面缩略图，仅用于参考外观。",
+                                                     image=preview, **options)
+                else:
+                    response = self.qianwen.generate_text(prompt, **options)
+                print(f"[VisualLocator] AI Response ({mode}/{tier}): {response}")
+                result.update(self._parse_batch(response, asked, by_id))
+            except (QianwenAPIError, CircuitOpenError):
+                raise
             except Exception as e:
                 print(f"[VisualLocator] Attempt {attempt+1} failed: {e}")
-                if attempt < self.retry_count - 1:
-                    time.sleep(1)
-                    continue
+                attempt += 1
+                mode = self._escalate(mode)
+                continue
+            
+            pending = [desc for desc in pending if desc not in result]
+            if not pending:
+                return result
+            if mode != 'image':
+                # 元素表解决不了的描述升级到看图，不计入重试次数
+                mode = self._escalate(mode)
+                print(f"[VisualLocator] Escalating to {mode} prompt")
+                continue
+            next_tier = router.next_tier('locate', tier)
+            if next_tier:
+                tier = next_tier
+                print(f"[VisualLocator] Escalating to {tier} model")
+                continue
+            attempt += 1
         
-        raise Exception(f"无法定位元素: {description}")
+        raise Exception(f"无法定位元素: {', '.join(pending)}")
 
-    def click_element(self, description: str) -> bool:
-        """点击元素"""
-        elem = self.find_element(description)
+    def _parse_batch(self, response: str, descriptions: List[str], by_id: Dict[int, VisualElement],
+                     quiet: bool = False) -> Dict[str, VisualElement]:
+        """解析批量定位回答 {"序号": 元素编号}，只返回有效编号对应的元素
+
+        Raises:
+            ValueError: 回答不是 JSON 对象
+        """
+        answer = self.qianwen.parse_json_response(response)
+        if not isinstance(answer, dict):
+            raise ValueError(f"返回格式错误: {response[:100]}")
+        found = {}
+        for i, desc in enumerate(descriptions, start=1):
+            try:
+                elem_id = int(answer.get(str(i), -1))
+            except (TypeError, ValueError):
+                continue
+            if elem_id in by_id:
+                found[desc] = by_id[elem_id]
+            elif elem_id != -1 and not quiet:
+                print(f"[VisualLocator] AI 返回了无效的 ID: {desc} -> {elem_id}")
+        return found
+
+    def _complete_batch(self, response: str, descriptions: List[str],
+                        by_id: Dict[int, VisualElement]) -> Optional[Dict[str, VisualElement]]:
+        """所有描述都找到时返回结果（决定回答能否写入缓存）"""
+        found = self._parse_batch(response, descriptions, by_id, quiet=True)
+        return found if len(found) == len(descriptions) else None
+
+    def click_element(self, description: str, element: Optional[VisualElement] = None) -> bool:
+        """点击元素（已定位的 element 直接点击，不再查找）
+        
+        开启 ai.locator.verify_tap 时，点击后等界面稳定，界面没有任何变化且下一个候选的
+        置信度与当前候选相差不超过 ai.locator.tap_gap，才在本地尝试下一个候选（不再调用模型）。
+        响应慢的正确点击（如等待网络的登录）不会因此多点一次别的按钮。
+        """
+        elem = element or self.find_element(description)
+        self._tap(elem)
+        
+        # 传入的元素如果就是 find_element 排好序的首选（如预取结果），同样可以本地换候选
+        ranking = self._rankings.get(description)
+        if not self.verify_tap or not ranking or ranking.current is not elem:
+            return True
+        
+        while ranking.cursor + 1 < len(ranking.candidates) and ranking.close_call(self.tap_gap):
+            self.u2.wait_idle()
+            xml_str = self.u2.get_page_source()
+            if not xml_str or hierarchy_digest(xml_str) != ranking.digest:
+                break
+            ranking.cursor += 1
+            print(f"[VisualLocator] Tap had no effect, trying candidate #{ranking.cursor + 1}")
+            self._tap(ranking.current)
+        return True
+
+    def _tap(self, elem: VisualElement):
         x, y = elem.center
         print(f"[VisualLocator] Clicking ID:{elem.id} @ ({x}, {y})")
         self.u2.tap(x, y)
-        return True
 
-    def input_text(self, text: str, description: str) -> bool:
+    def input_text(self, text: str, description: str, element: Optional[VisualElement] = None) -> bool:
         """输入文本"""
-        # 1. 点击
-        self.click_element(description)
-        time.sleep(1)
+        # 1. 点击，等输入框获得焦点、键盘弹出
+        self.click_element(description, element)
+        self.u2.wait_idle()
         
-        # 2. 输入 (剪贴板方案)
+        # 2. 输入 (剪贴板方案，set_clipboard 是同步调用，可以直接粘贴)
         try:
             self.u2.device.set_clipboard(text)
-            time.sleep(0.5)
             self.u2.device.shell('input keyevent 279') # Paste
-            time.sleep(0.5)
+            self.u2.wait_idle()
             
             # 尝试回车确认
             print("Attempting Enter key...")
@@ -290,19 +874,36 @@ Assistant: 5
     def get_text(self, description: str) -> str:
         """获取文本"""
         elem = self.find_element(description)
-        node = elem.elem_node
-        return node.get('text') or node.get('content-desc') or ""
+        return elem.text or elem.desc or (elem.aliases[0] if elem.aliases else "")
+        
+    def _verify_by_hierarchy(self, expected_state: str) -> Optional[Dict]:
+        """用当前 UI 结构判定断言，无法判定返回 None"""
+        xml_str = self.u2.get_page_source()
+        if not xml_str:
+            return None
+        size = self.u2.get_window_size()
+        table = ElementTable.from_xml(xml_str)
+        return self.evaluator.evaluate(expected_state, table, size['width'], size['height'])
+
+    def verify_state(self, expected_state: str, image: Image.Image = None) -> Dict:
+        """验证状态 (复用 AI 视觉能力)
+        
+        Args:
+            expected_state: 期望状态描述
+            image: 已采集的截图（可选，不传则重新截图）
+        """
+        # 先用 UI 结构判定文本类断言，判定不了再发截图
+        if self.assert_hierarchy_first:
+            result = self._verify_by_hierarchy(expected_state)
+            if result is not None:
+                print(f"[VisualLocator] Verified by hierarchy: {result['reason']}")
+                return result
         
-    def verify_state(self, expected_state: str) -> Dict:
-        """验证状态 (复用 AI 视觉能力)"""
         # 同样使用截图+Prompt
-        screenshot = self.u2.get_screenshot_bytes()
+        screenshot = self.pipeline.prepare(image) if image is not None else self._capture_image()
         if not screenshot:
             return {'passed': False, 'reason': 'Screenshot failed'}
-            
-        # 保存临时图片
-        with open("verify_temp.png", "wb") as f:
-            f.write(screenshot)
+        self._save_debug_image("verify", screenshot)
             
         prompt = f"""
 任务：判断当前界面是否满足条件 "{expected_state}"
@@ -311,26 +912,148 @@ Assistant: 5
 返回 JSON 格式：
 {{"passed": true/false, "reason": "判断理由"}}
 """
-        response = self.qianwen.generate(prompt, image_path="verify_temp.png")
-        return self.qianwen.parse_json_response(response)
+        return self.qianwen.ask(prompt, self._accept_verdict, image=screenshot, site='verify')
+
+    def _accept_verdict(self, response: str) -> Dict:
+        return self.qianwen.parse_json_response(response, schema='verify')
+
+    def _screen_signature(self, image: Optional[Image.Image]):
+        """轮询用的廉价界面签名（感知哈希或 UI 结构摘要）"""
+        if self.wait_signature == 'hierarchy':
+            xml = self.u2.get_page_source()
+            return hierarchy_digest(xml) if xml else None
+        return frame_hash(image) if image is not None else None
+
+    def snapshot_signature(self, snapshot: Snapshot):
+        """快照的界面签名（与 wait_for_condition 使用同一种签名）"""
+        if self.wait_signature == 'hierarchy':
+            return hierarchy_digest(snapshot.xml)
+        return frame_hash(snapshot.image)
+
+    def screen_matches(self, signature) -> bool:
+        """当前界面与签名对应的界面是否相同"""
+        image = None if self.wait_signature == 'hierarchy' else self.u2.get_screenshot_image()
+        current = self._screen_signature(image)
+        return current is not None and not self._screen_changed(current, signature)
+
+    def _screen_changed(self, signature, last_signature) -> bool:
+        if signature is None or last_signature is None:
+            return True
+        if isinstance(signature, int):
+            return hamming(signature, last_signature) > self.wait_change_threshold
+        return signature != last_signature
 
     def wait_for_condition(self, condition: str, timeout: int = 30) -> bool:
+        """等待条件满足
+        
+        高频轮询廉价的界面签名，只有界面相对上一次"未满足"的判定发生变化时
+        才重新调用模型；界面不变时轮询间隔指数退避。
+        """
         start = time.time()
-        while time.time() - start < timeout:
-            try:
-                res = self.verify_state(condition)
-                if res.get('passed'): return True
-            except:
-                pass
-            time.sleep(2)
+        deadline = start + timeout
+        interval = self.wait_poll_min
+        last_signature = None
+        last_call = 0.0
+        model_calls = 0
+        
+        while time.time() < deadline:
+            image = self.u2.get_screenshot_image()
+            signature = self._screen_signature(image)
+            
+            if self._screen_changed(signature, last_signature) and \
+                    time.time() - last_call >= self.wait_model_interval:
+                last_call = time.time()
+                model_calls += 1
+                try:
+                    res = self.verify_state(condition, image=image)
+                    if res.get('passed'):
+                        print(f"[VisualLocator] Condition met after {time.time() - start:.1f}s, "
+                              f"{model_calls} model call(s)")
+                        return True
+                    # 只有明确"未满足"的界面才不再重复询问；调用出错时下一轮照常重试
+                    last_signature = signature
+                except Exception as e:
+                    print(f"[VisualLocator] Verify failed: {e}")
+                interval = self.wait_poll_min
+            else:
+                interval = min(interval * 1.5, self.wait_poll_max)
+            
+            time.sleep(max(0.0, min(interval, deadline - time.time())))
         raise TimeoutError(f"Wait timeout: {condition}")
         
     def query_data(self, query: str) -> any:
+        """提取界面数据
+        
+        先从 UI 结构中识别列表行并抽取文本表格，用纯文本模型作答；
+        表格缺少的字段才截取列表区域交给多模态模型补全。
+        """
+        if self.query_hierarchy_first:
+            snapshot = self.u2.capture_snapshot()
+            if snapshot is not None:
+                table = ElementTable.from_xml(snapshot.xml)
+                extracted = self.query_engine.extract(table, snapshot.width, snapshot.height)
+                if not extracted.empty:
+                    return self._query_from_hierarchy(query, extracted, snapshot)
+        
         # 类似 verify_state，让 AI 看图提取
-        screenshot = self.u2.get_screenshot_bytes()
-        with open("query_temp.png", "wb") as f:
-            f.write(screenshot)
+        screenshot = self._capture_image()
+        if not screenshot:
+            raise Exception("无法获取设备截图")
+        self._save_debug_image("query", screenshot)
             
         prompt = f"任务：{query}\n请根据截图提取数据，返回 JSON 格式。"
-        response = self.qianwen.generate(prompt, image_path="query_temp.png")
-        return self.qianwen.parse_json_response(response)
+        return self.qianwen.ask(prompt, self._accept_query, image=screenshot, site='query')
+
+    def _accept_query(self, response: str) -> any:
+        return self.qianwen.parse_json_response(response, schema='query')
+
+    def _query_from_hierarchy(self, query: str, extracted: ExtractedScreen, snapshot: Snapshot) -> any:
+        """基于 UI 结构文本作答，缺失字段用截图裁剪补全"""
+        table_text = extracted.to_text()
+        prompt = f"""任务：{query}
+
+下面是从当前界面 UI 结构中提取的文本（列表已按行分组，空单元格表示该行没有该字段）：
+{table_text}
+
+请只根据上面的文本完成任务，数值和文字保持原样，不要编造。
+返回 JSON（不要其他内容）：
+{{"data": <任务要求的结果>, "missing": [<文本中没有、需要看截图才能得到的字段名>]}}
+"""
+        try:
+            answer = self.qianwen.ask(
+                prompt, lambda r: self.qianwen.parse_json_response(r, schema='query_hierarchy'),
+                site='query', text=True)
+        except Exception as e:
+            print(f"[VisualLocator] Text query failed: {e}")
+            answer = {'data': None, 'missing': ['*']}
+        
+        missing = answer['missing']
+        if not missing and answer.get('data') is not None:
+            print("[VisualLocator] Query answered from hierarchy")
+            return answer['data']
+        
+        # 缺失字段：只发送列表区域的截图，并附上已提取的文本
+        image = snapshot.image
+        offset = (0, 0)
+        if extracted.group:
+            b = extracted.group.bounds
+            region = (max(0, b[0]), max(0, b[1]), min(image.width, b[2]), min(image.height, b[3]))
+            if region[2] > region[0] and region[3] > region[1]:
+                image = image.crop(region)
+                offset = region[:2]
+        small, scale = self.pipeline.downscale(image)
+        crop = self.pipeline.encode(small, scale, offset)
+        self._save_debug_image("query", crop)
+        
+        fields = "、".join(str(m) for m in missing if m != '*') or "所需字段"
+        prompt = f"""任务：{query}
+
+已从界面结构中提取的文本：
+{table_text}
+
+以上文本缺少：{fields}。请结合截图补全，已有的文本保持原样。
+返回最终结果的 JSON（不要其他内容）。"""
+        result = self.qianwen.ask(prompt, self._accept_query, image=crop, site='query')
+        if isinstance(result, dict) and set(result) == {'data'}:
+            return result['data']
+        return result
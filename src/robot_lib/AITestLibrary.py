@@ -53,6 +53,7 @@ class AITestLibrary:
     核心 Keywords:
     - AI Do: 自动规划风格，一句话完成多步骤
     - AI Click: 点击元素
+    - AI Locate Many: 批量定位元素
     - AI Input: 输入文本
     - AI Assert: 智能验证
     - AI Query: 数据提取
@@ -60,9 +61,21 @@ class AITestLibrary:
     """
     
     ROBOT_LIBRARY_SCOPE = 'GLOBAL'
+    ROBOT_LISTENER_API_VERSION = 2
     
     def __init__(self):
         self._connected = False
+        self.ROBOT_LIBRARY_LISTENER = self
+    
+    def end_keyword(self, name, attrs):
+        """监听器回调：关键字失败时把最近的调试截图写到 Robot 输出目录"""
+        if attrs.get('status') != 'FAIL':
+            return
+        from robot.libraries.BuiltIn import BuiltIn
+        from src.core.artifact_sink import get_artifact_sink
+        
+        output_dir = BuiltIn().get_variable_value('${OUTPUT DIR}') or '.'
+        get_artifact_sink().flush_recent(output_dir)
     
     def _ensure_connected(self):
         """确保已连接"""
@@ -126,11 +139,8 @@ class AITestLibrary:
                         package = pkg
                         break
         
-        if package:
-            u2.device.app_start(package)
-        else:
-            u2.launch_app()
-        time.sleep(2)
+        # 未指定或无法识别时启动配置的应用；启动后等待界面稳定
+        u2.launch_app(package)
     
     @keyword('AI Close App')
     def ai_close_app(self):
@@ -161,31 +171,79 @@ class AITestLibrary:
         planner = _get_planner()
         planner.execute(instruction)
     
+    @keyword('AI Locate Many')
+    def ai_locate_many(self, *element_descriptions: str) -> dict:
+        """
+        批量定位元素（同一屏幕一次模型调用）
+        
+        返回 {描述: 元素信息}，可直接传给 AI Click / AI Input 依次操作，
+        不再重复截图和调用模型。
+        
+        Args:
+            element_descriptions: 多个元素描述
+        
+        Returns:
+            dict: {描述: {'id', 'center', 'bounds', 'text'}}
+        
+        Examples:
+            | ${els}= | AI Locate Many | 用户名输入框 | 密码输入框 | 登录按钮 |
+            | AI Input | testuser | ${els}[用户名输入框] |
+            | AI Input | password123 | ${els}[密码输入框] |
+            | AI Click | ${els}[登录按钮] |
+        """
+        self._ensure_connected()
+        locator = _get_locator()
+        found = locator.find_elements(list(element_descriptions))
+        return {
+            desc: {
+                'id': elem.id,
+                'center': list(elem.center),
+                'bounds': list(elem.bounds),
+                'text': elem.text or elem.desc or (elem.aliases[0] if elem.aliases else ''),
+            }
+            for desc, elem in found.items()
+        }
+    
+    def _split_target(self, element_description):
+        """区分描述字符串和 AI Locate Many 返回的元素信息"""
+        if isinstance(element_description, dict):
+            from src.llm.visual_locator import VisualElement
+            elem = VisualElement(
+                id=element_description.get('id', 0),
+                bounds=tuple(element_description['bounds']),
+                center=tuple(element_description['center']),
+                text=element_description.get('text', ''),
+            )
+            return elem.text or f"ID:{elem.id}", elem
+        return element_description, None
+    
     @keyword('AI Click')
-    def ai_click(self, element_description: str):
+    def ai_click(self, element_description):
         """
         点击元素（纯视觉定位）
         
         Args:
-            element_description: 元素的自然语言描述
+            element_description: 元素的自然语言描述，或 AI Locate Many 返回的元素
         
         Examples:
             | AI Click | 登录按钮 |
             | AI Click | 第一个商品 |
             | AI Click | 购物车图标 |
+            | AI Click | ${els}[登录按钮] |
         """
         self._ensure_connected()
         locator = _get_locator()
-        locator.click_element(element_description)
+        description, element = self._split_target(element_description)
+        locator.click_element(description, element)
     
     @keyword('AI Input')
-    def ai_input(self, text: str, element_description: str):
+    def ai_input(self, text: str, element_description):
         """
         输入文本
         
         Args:
             text: 要输入的文本
-            element_description: 输入框的描述
+            element_description: 输入框的描述，或 AI Locate Many 返回的元素
         
         Examples:
             | AI Input | testuser | 用户名输入框 |
@@ -194,7 +252,8 @@ class AITestLibrary:
         """
         self._ensure_connected()
         locator = _get_locator()
-        locator.input_text(text, element_description)
+        description, element = self._split_target(element_description)
+        locator.input_text(text, description, element)
     
     @keyword('AI Swipe')
     def ai_swipe(self, direction: str, distance: int = 500):
@@ -226,7 +285,7 @@ class AITestLibrary:
         else:
             raise ValueError(f"未知方向: {direction}")
         
-        time.sleep(0.5)
+        u2.wait_idle()
     
     @keyword('AI Scroll To')
     def ai_scroll_to(self, element_description: str, max_scrolls: int = 5):
@@ -368,7 +427,7 @@ class AITestLibrary:
         self._ensure_connected()
         u2 = _get_u2()
         u2.press_back()
-        time.sleep(0.5)
+        u2.wait_idle()
     
     @keyword('AI Home')
     def ai_home(self):
@@ -381,7 +440,7 @@ class AITestLibrary:
         self._ensure_connected()
         u2 = _get_u2()
         u2.press_home()
-        time.sleep(0.5)
+        u2.wait_idle()
     
     @keyword('AI Sleep')
     def ai_sleep(self, seconds: str):
@@ -0,0 +1,82 @@
+"""AssertionEvaluator 本地判定规则"""
+import pytest
+
+from src.llm.assertion_evaluator import AssertionEvaluator
+from src.llm.element_table import ElementTable
+
+
+class FakeQianwen:
+    """按断言返回预设的谓词"""
+
+    def __init__(self, predicates):
+        self.predicates = predicates
+
+    def ask(self, prompt, accept, **kwargs):
+        for assertion, predicate in self.predicates.items():
+            if f"断言: {assertion}\n" in prompt:
+                return predicate
+        raise ValueError("unexpected assertion")
+
+
+def _table(*texts) -> ElementTable:
+    nodes = ''.join(
+        f'<node index="{i}" text="{text}" resource-id="" class="android.widget.TextView" package="com.demo" '
+        f'content-desc="" checkable="false" checked="false" clickable="false" enabled="true" focusable="false" '
+        f'focused="false" scrollable="false" long-clickable="false" password="false" selected="false" '
+        f'bounds="[0,{i * 100}][1080,{i * 100 + 80}]" />'
+        for i, text in enumerate(texts))
+    return ElementTable.from_xml('<?xml version="1.0" encoding="UTF-8"?><hierarchy rotation="0">'
+                                 f'{nodes}</hierarchy>')
+
+
+def _evaluate(assertion, predicate, *texts):
+    evaluator = AssertionEvaluator(FakeQianwen({assertion: predicate}))
+    return evaluator.evaluate(assertion, _table(*texts), 1080, 1920)
+
+
+def _checks(*checks, logic='all'):
+    return {'decidable': True, 'logic': logic, 'checks': list(checks)}
+
+
+def test_present_text_passes():
+    result = _evaluate('显示登录成功', _checks({'text': '登录成功', 'match': 'contains', 'min': 1, 'max': None}),
+                       '登录成功，欢迎回来')
+    assert result['passed'] is True
+
+
+def test_unexpected_text_fails():
+    result = _evaluate('不显示密码错误', _checks({'text': '密码错误', 'match': 'contains', 'min': 0, 'max': 0}),
+                       '密码错误')
+    assert result['passed'] is False
+
+
+def test_absence_only_is_undecidable():
+    # 错误提示可能是 Toast 或 WebView 文本，不在 UI 结构里
+    assert _evaluate('不显示密码错误提示',
+                     _checks({'text': '密码错误', 'match': 'contains', 'min': 0, 'max': 0}),
+                     '登录') is None
+
+
+def test_absence_mixed_with_presence_is_undecidable():
+    predicate = _checks({'text': '首页', 'match': 'exact', 'min': 1, 'max': None},
+                        {'text': '密码错误', 'match': 'contains', 'min': 0, 'max': 0})
+    assert _evaluate('显示首页且没有错误', predicate, '首页') is None
+
+
+def test_missing_text_is_undecidable():
+    assert _evaluate('显示登录成功', _checks({'text': '登录成功', 'min': 1, 'max': None}), '首页') is None
+
+
+@pytest.mark.parametrize('check', [
+    {'text': '登录', 'min': '至少1', 'max': None},
+    {'text': '登录', 'min': 1, 'max': '很多'},
+    {'text': '登录', 'min': 2, 'max': 1},
+    {'text': '登录', 'min': -1, 'max': None},
+])
+def test_invalid_bounds_fall_back_to_model(check):
+    assert _evaluate('显示登录', _checks(check), '登录') is None
+
+
+def test_numeric_string_bounds_are_accepted():
+    result = _evaluate('显示一个登录', _checks({'text': '登录', 'match': 'exact', 'min': '1', 'max': '1'}), '登录')
+    assert result['passed'] is True
@@ -0,0 +1,90 @@
+"""ElementIndex 本地快速定位的匹配规则"""
+import pytest
+
+from src.llm.element_index import ElementIndex
+from src.llm.element_table import ElementTable
+from src.llm.visual_locator import interactable_elements
+
+
+def _node(cls, text='', bounds='[0,0][100,100]', clickable='false', desc='', rid='', focusable='false'):
+    return (f'<node index="0" text="{text}" resource-id="{rid}" class="{cls}" package="com.demo" '
+            f'content-desc="{desc}" checkable="false" checked="false" clickable="{clickable}" '
+            f'enabled="true" focusable="{focusable}" focused="false" scrollable="false" '
+            f'long-clickable="false" password="false" selected="false" bounds="{bounds}" />')
+
+
+def _screen(*nodes) -> ElementIndex:
+    xml = ('<?xml version="1.0" encoding="UTF-8"?><hierarchy rotation="0">'
+           '<node index="0" text="" resource-id="" class="android.widget.FrameLayout" package="com.demo" '
+           'content-desc="" checkable="false" checked="false" clickable="false" enabled="true" '
+           'focusable="false" focused="false" scrollable="false" long-clickable="false" password="false" '
+           'selected="false" bounds="[0,0][1080,1920]">' + ''.join(nodes) + '</node></hierarchy>')
+    return ElementIndex(interactable_elements(ElementTable.from_xml(xml), 1080, 1920))
+
+
+@pytest.fixture
+def login():
+    return _screen(
+        _node('android.widget.TextView', '用户名', '[40,300][240,380]'),
+        _node('android.widget.EditText', '请输入用户名', '[260,300][1040,380]', 'true', focusable='true',
+              rid='com.demo:id/username'),
+        _node('android.widget.TextView', '密码', '[40,420][240,500]'),
+        _node('android.widget.EditText', '请输入密码', '[260,420][1040,500]', 'true', focusable='true',
+              rid='com.demo:id/password'),
+        _node('android.widget.Button', '登录', '[40,600][1040,700]', 'true'),
+        _node('android.widget.TextView', '注册账号', '[40,760][500,840]', 'true'),
+        _node('android.widget.TextView', '忘记密码？', '[580,760][1040,840]', 'true'),
+    )
+
+
+def test_exact_match(login):
+    assert login.resolve('登录').text == '登录'
+    assert login.lookup('登录')[0].kind == 'exact'
+
+
+def test_normalized_match(login):
+    elem = login.resolve('忘记密码?')
+    assert elem.text == '忘记密码？'
+    assert login.lookup('忘记密码?')[0].kind == 'normalized'
+
+
+def test_role_suffix_button_requires_clickable(login):
+    assert login.resolve('登录按钮').text == '登录'
+
+
+def test_fuzzy_match(login):
+    matches = login.lookup('注册新账号')
+    assert matches[0].element.text == '注册账号'
+    assert matches[0].kind == 'fuzzy'
+
+
+def test_ambiguous_returns_none():
+    index = _screen(
+        _node('android.widget.Button', '确定', '[40,600][500,700]', 'true'),
+        _node('android.widget.Button', '确定', '[580,600][1040,700]', 'true'),
+    )
+    assert index.resolve('确定') is None
+
+
+def test_positional_description_returns_none(login):
+    assert login.resolve('底部的登录') is None
+
+
+@pytest.mark.parametrize('description', ['用户名输入框', '密码输入框'])
+def test_field_description_never_resolves_to_label(login, description):
+    elem = login.resolve(description)
+    assert elem is None or 'EditText' in elem.class_name
+
+
+def test_field_resolves_when_edit_text_matches():
+    index = _screen(
+        _node('android.widget.TextView', '用户名', '[40,300][240,380]'),
+        _node('android.widget.EditText', '用户名', '[260,300][1040,380]', 'true', focusable='true'),
+    )
+    elem = index.resolve('用户名输入框')
+    assert elem is not None and 'EditText' in elem.class_name
+
+
+def test_button_suffix_skips_static_label():
+    index = _screen(_node('android.widget.TextView', '提交', '[40,300][240,380]'))
+    assert index.resolve('提交按钮') is None